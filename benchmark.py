@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""Reproducible throughput benchmarks for the conversion pipeline.
+
+Generates synthetic corpora that vary page size, nesting depth, link density
+and file count (optionally alongside real corpora given with --corpus), then
+runs main.py on each corpus once per engine/parser combination. For every run
+it reports files/sec, MB/sec and the peak RSS of the converter process, all
+taken from the job's metrics_<folder>.json. Results can be saved as a baseline
+and later runs compared against it; a throughput drop or memory growth beyond
+--tolerance is flagged as a regression and makes the script exit with 1.
+
+Engines whose tools are missing (pandoc, or Node.js and its modules for
+html-to-text) and parsers that are not installed are skipped, not failed.
+
+With --check, every corpus is also used to verify that the single-pass scorer
+picks the same content element as get_content_score and that the streaming
+cleaner matches the serialize-and-reparse cleaner.
+
+Usage:
+    python benchmark.py [--corpus DIR ...] [--engines native pandoc] [--parsers html5lib lxml]
+                        [--scale 1.0] [--repeat 1] [--check]
+                        [--save-baseline FILE] [--baseline FILE] [--tolerance 0.10]
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+import main
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+ENGINES: List[str] = ['native', 'pandoc', 'html-to-text']
+WORDS: List[str] = (
+    "the converter reads each page picks the main content element and writes clean text "
+    "for language models while navigation footers scripts and advertising are removed so "
+    "that only the article body with its headings lists tables and code samples remains"
+).split()
+
+
+@dataclass
+class CorpusSpec:
+    """Shape of one synthetic corpus."""
+    name: str
+    files: int
+    page_kb: int  # Approximate size of each page
+    depth: int  # Wrapper <div>s around the article
+    link_density: float  # Fraction of article words that are links
+    seed: int = 1
+
+
+SYNTHETIC_CORPORA: List[CorpusSpec] = [
+    CorpusSpec('small-pages', files=200, page_kb=8, depth=6, link_density=0.05),
+    CorpusSpec('large-pages', files=20, page_kb=400, depth=8, link_density=0.05),
+    CorpusSpec('deep-nesting', files=50, page_kb=32, depth=300, link_density=0.05),
+    CorpusSpec('link-heavy', files=100, page_kb=16, depth=6, link_density=0.6),
+]
+
+
+def _sentence(rng: random.Random, link_density: float) -> str:
+    words = []
+    for _ in range(rng.randint(8, 24)):
+        word = rng.choice(WORDS)
+        if rng.random() < link_density:
+            word = f'<a href="/wiki/{word}-{rng.randint(1, 9999)}">{word}</a>'
+        words.append(word)
+    return ' '.join(words).capitalize() + '.'
+
+
+def _article_block(rng: random.Random, spec: CorpusSpec, index: int) -> str:
+    kind = rng.random()
+    if kind < 0.08:
+        return f"<h2>Section {index}: {_sentence(rng, 0)}</h2>"
+    if kind < 0.14:
+        items = ''.join(f"<li>{_sentence(rng, spec.link_density)}</li>" for _ in range(rng.randint(3, 8)))
+        return f"<ul>{items}</ul>"
+    if kind < 0.18:
+        rows = ''.join(
+            "<tr>" + ''.join(f"<td>{rng.choice(WORDS)} {rng.randint(0, 999)}</td>" for _ in range(4)) + "</tr>"
+            for _ in range(rng.randint(3, 10))
+        )
+        return f"<table><tr><th>Name</th><th>Value</th><th>Unit</th><th>Note</th></tr>{rows}</table>"
+    if kind < 0.21:
+        return f"<pre><code>def step_{index}(page):\n    return convert(page, &quot;md&quot;)\n</code></pre>"
+    if kind < 0.24:
+        return f"<blockquote><p>{_sentence(rng, 0)}</p></blockquote>"
+    sentences = ' '.join(_sentence(rng, spec.link_density) for _ in range(rng.randint(2, 6)))
+    return f'<p class="text">{sentences} <strong>{rng.choice(WORDS)}</strong> <em>{rng.choice(WORDS)}</em></p>'
+
+
+def generate_page(spec: CorpusSpec, index: int) -> str:
+    """Build one synthetic page; the same spec and index always give the same bytes."""
+    rng = random.Random(spec.seed * 1000003 + index)
+    menu = ''.join(f'<li><a href="/section/{i}">Section {i}</a></li>' for i in range(12))
+    blocks: List[str] = [f"<h1>Synthetic article {index}</h1>"]
+    size = 0
+    while size < spec.page_kb * 1024:
+        blocks.append(_article_block(rng, spec, len(blocks)))
+        size += len(blocks[-1])
+    wrappers_open = ''.join(f'<div class="layout level-{level}">' for level in range(spec.depth))
+    wrappers_close = '</div>' * spec.depth
+    return (
+        f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>{spec.name} page {index}</title>"
+        "<style>body { font-family: sans-serif; } .sidebar { float: right; }</style>"
+        "<script>window.analytics = { track: function () { return true; } };</script></head>"
+        f"<body><header><nav class=\"menu\"><ul>{menu}</ul></nav></header>"
+        f"{wrappers_open}<article class=\"post-content\">{''.join(blocks)}</article>{wrappers_close}"
+        f"<aside class=\"sidebar\"><ul>{menu}</ul></aside>"
+        "<footer class=\"footer\"><p>Copyright, all rights reserved.</p></footer>"
+        "<script>window.analytics.track('view');</script></body></html>"
+    )
+
+
+def generate_corpus(spec: CorpusSpec, root: str, scale: float) -> str:
+    """Write the corpus under root unless an identical one is already there; return its directory."""
+    corpus_dir = os.path.join(root, spec.name)
+    files = max(int(spec.files * scale), 1)
+    marker_path = os.path.join(corpus_dir, '.corpus.json')
+    marker = dict(asdict(spec), files=files)
+    if os.path.exists(marker_path):
+        with open(marker_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == marker:
+                return corpus_dir
+        shutil.rmtree(corpus_dir)
+    os.makedirs(corpus_dir, exist_ok=True)
+    for index in range(files):
+        with open(os.path.join(corpus_dir, f"page{index:05d}.html"), 'w', encoding='utf-8') as f:
+            f.write(generate_page(spec, index))
+    with open(marker_path, 'w', encoding='utf-8') as f:
+        json.dump(marker, f)
+    return corpus_dir
+
+
+def check_corpus(corpus_dir: str, parser: str) -> Tuple[int, List[str], List[str]]:
+    """Compare the single-pass scorer and streaming cleaner against the reference
+    implementations; return (files checked, scorer mismatches, cleaner mismatches)."""
+    scorer_mismatches: List[str] = []
+    cleaner_mismatches: List[str] = []
+    filenames = sorted(f for f in os.listdir(corpus_dir) if f.endswith(('.html', '.htm')))
+    for filename in filenames:
+        soup = BeautifulSoup(main.decode_html(main.read_input_file(corpus_dir, filename)), parser)
+        for tag in soup(main.STRIPPED_TAGS):
+            tag.decompose()
+
+        candidates = main.score_candidates(soup)
+        reference = [(tag, main.get_content_score(tag)) for tag in soup.find_all(main.CANDIDATE_TAGS)]
+        if [(id(tag), score) for tag, score in candidates] != [(id(tag), score) for tag, score in reference]:
+            scorer_mismatches.append(filename)
+
+        chosen = None
+        if reference:
+            best_element, best_score = max(reference, key=lambda candidate: candidate[1])
+            if best_score >= main.MIN_CONTENT_SCORE:
+                chosen = best_element
+        chosen = chosen or soup.find('body')
+        if chosen is not None:
+            streamed = main.clean_html_for_llm(chosen, parser)
+            if streamed != main.clean_html_for_llm_reparse(chosen, parser):
+                cleaner_mismatches.append(filename)
+    return len(filenames), scorer_mismatches, cleaner_mismatches
+
+
+def unavailable_reason(engine: str) -> Optional[str]:
+    """Return why an engine cannot run here, or None if a probe conversion succeeds."""
+    if engine == 'pandoc' and shutil.which('pandoc') is None:
+        return "pandoc not found"
+    if engine == 'html-to-text' and shutil.which('node') is None:
+        return "node not found"
+    if main.convert_html_to_output('<p>probe</p>', 'md', engine) is None:
+        return "probe conversion failed"
+    return None
+
+
+def run_job(corpus_dir: str, output_dir: str, engine: str, parser: str,
+            output_format: str, workers: int) -> Dict:
+    """Run main.py on one corpus in a child process and return its throughput and peak RSS."""
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    command = [sys.executable, MAIN_SCRIPT, corpus_dir, output_dir, '--engine', engine,
+               '--parser', parser, '--format', output_format, '--workers', str(workers)]
+    returncode = subprocess.call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    folder_name = os.path.basename(os.path.normpath(corpus_dir))
+    metrics_path = os.path.join(output_dir, f"metrics_{folder_name}.json")
+    if not os.path.exists(metrics_path):
+        return {"status": f"exit {returncode}"}
+    with open(metrics_path, 'r', encoding='utf-8') as f:
+        metrics = json.load(f)
+    wall_seconds = metrics["wall_s"] or 1e-9
+    peak_rss = metrics.get("peak_rss_bytes")
+    return {
+        "status": "ok" if returncode == 0 else f"exit {returncode}",
+        "files": metrics["files"],
+        "files_per_s": round(metrics["files"] / wall_seconds, 3),
+        "mb_per_s": round(metrics["bytes_in"] / (1024 * 1024) / wall_seconds, 3),
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1) if peak_rss is not None else None,
+    }
+
+
+def compare_to_baseline(result: Dict, baseline: Optional[Dict], tolerance: float) -> str:
+    """Return 'ok', 'faster', 'new' or a REGRESSION note for one result."""
+    if not baseline or "files_per_s" not in baseline or "files_per_s" not in result:
+        return "new"
+    notes = []
+    if result["files_per_s"] < baseline["files_per_s"] * (1 - tolerance):
+        notes.append(f"throughput {result['files_per_s'] / baseline['files_per_s'] - 1:+.0%}")
+    if result["peak_rss_mb"] and baseline.get("peak_rss_mb") and result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        notes.append(f"peak RSS {result['peak_rss_mb'] / baseline['peak_rss_mb'] - 1:+.0%}")
+    if notes:
+        return "REGRESSION: " + ", ".join(notes)
+    if result["files_per_s"] > baseline["files_per_s"] * (1 + tolerance):
+        return "faster"
+    return "ok"
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the converter on synthetic and real corpora.")
+    parser.add_argument("--corpus", action="append", default=[], metavar="DIR",
+                        help="A real corpus directory to benchmark as well (repeatable).")
+    parser.add_argument("--no-synthetic", action="store_true", help="Only benchmark the --corpus directories.")
+    parser.add_argument("--engines", nargs="+", default=ENGINES, choices=ENGINES,
+                        help="Engines to benchmark (default: all available).")
+    parser.add_argument("--parsers", nargs="+", default=main.PARSER_BACKENDS, choices=main.PARSER_BACKENDS,
+                        help="Parser backends to benchmark (default: all installed).")
+    parser.add_argument("--format", choices=['md', 'txt'], default='md', help="Output format (default: md).")
+    parser.add_argument("--workers", type=int, default=1, help="--workers passed to main.py (default: 1).")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply synthetic file counts by this factor (default: 1.0).")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per combination; the fastest is kept (default: 1).")
+    parser.add_argument("--work-dir", help="Where corpora and outputs are kept (default: a temporary directory).")
+    parser.add_argument("--check", action="store_true",
+                        help="Verify scorer and cleaner equivalence on every corpus before timing.")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Write the results to FILE as a new baseline.")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare the results against a saved baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="Relative slowdown or memory growth that counts as a regression (default: 0.10).")
+    args = parser.parse_args()
+
+    # Probe conversions log errors for missing engines; those are reported as skips instead.
+    logging.basicConfig(level=logging.CRITICAL, format='%(levelname)s: %(message)s')
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="html-converter-bench-")
+    corpora: List[str] = [] if args.no_synthetic else [
+        generate_corpus(spec, os.path.join(work_dir, 'corpora'), args.scale) for spec in SYNTHETIC_CORPORA
+    ]
+    for corpus_dir in args.corpus:
+        if not os.path.isdir(corpus_dir):
+            print(f"Error: Corpus directory '{corpus_dir}' not found.", file=sys.stderr)
+            sys.exit(1)
+        corpora.append(os.path.abspath(corpus_dir))
+
+    parsers = []
+    for backend in args.parsers:
+        if backend == 'lxml':
+            try:
+                import lxml  # noqa: F401
+            except ImportError:
+                print("Skipping parser lxml: not installed.")
+                continue
+        parsers.append(backend)
+    engines = []
+    for engine in args.engines:
+        reason = unavailable_reason(engine)
+        if reason:
+            print(f"Skipping engine {engine}: {reason}.")
+        else:
+            engines.append(engine)
+
+    failed_checks = False
+    if args.check:
+        print(f"\n{'='*25} EQUIVALENCE CHECKS {'='*25}")
+        for corpus_dir in corpora:
+            for backend in parsers:
+                checked, scorer_mismatches, cleaner_mismatches = check_corpus(corpus_dir, backend)
+                name = os.path.basename(corpus_dir)
+                print(f"  - {name} ({backend}): {checked} files, "
+                      f"scorer mismatches {len(scorer_mismatches)}, cleaner mismatches {len(cleaner_mismatches)}")
+                for filename in (scorer_mismatches + cleaner_mismatches)[:5]:
+                    print(f"      {filename}")
+                failed_checks = failed_checks or bool(scorer_mismatches or cleaner_mismatches)
+
+    baseline: Dict = {}
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        baseline = saved.get("results", {})
+        environment = saved.get("environment", {})
+        for setting in ("workers", "format", "scale"):
+            if setting in environment and environment[setting] != getattr(args, setting):
+                print(f"Warning: baseline was recorded with --{setting} {environment[setting]}; "
+                      f"this run uses {getattr(args, setting)}, so results are not comparable.")
+
+    results: Dict[str, Dict] = {}
+    regressions = 0
+    print(f"\n{'corpus':<16} {'engine':<13} {'parser':<9} {'files':>6} {'files/s':>9} {'MB/s':>7} {'RSS MB':>8}  vs baseline")
+    for corpus_dir in corpora:
+        name = os.path.basename(os.path.normpath(corpus_dir))
+        for engine in engines:
+            for backend in parsers:
+                key = f"{name}/{engine}/{backend}"
+                output_dir = os.path.join(work_dir, 'output', name, f"{engine}-{backend}")
+                runs = [run_job(corpus_dir, output_dir, engine, backend, args.format, args.workers)
+                        for _ in range(max(args.repeat, 1))]
+                result = max(runs, key=lambda run: run.get("files_per_s", 0))
+                results[key] = result
+                if "files_per_s" not in result:
+                    print(f"{name:<16} {engine:<13} {backend:<9}  {result['status']}")
+                    continue
+                verdict = compare_to_baseline(result, baseline.get(key), args.tolerance) if args.baseline else "-"
+                if result["status"] != "ok":
+                    verdict += f" ({result['status']})"
+                regressions += verdict.startswith("REGRESSION")
+                rss = f"{result['peak_rss_mb']:.1f}" if result["peak_rss_mb"] is not None else "n/a"
+                print(f"{name:<16} {engine:<13} {backend:<9} {result['files']:>6} {result['files_per_s']:>9.2f} "
+                      f"{result['mb_per_s']:>7.2f} {rss:>8}  {verdict}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                "environment": {
+                    "converter": main.VERSION,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpus": os.cpu_count(),
+                    "workers": args.workers,
+                    "format": args.format,
+                    "scale": args.scale,
+                },
+                "results": results,
+            }, f, indent=2)
+        print(f"\nBaseline saved to: '{args.save_baseline}'")
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if regressions:
+        print(f"\n{regressions} regression(s) beyond {args.tolerance:.0%} of the baseline.")
+    if regressions or failed_checks:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Report how much extracted content changes between HTML parser backends.
+
+Every HTML file in a directory is run through main.extract_file() once with
+html5lib (the reference backend) and once per alternative backend. For each
+backend the script prints how many files came out identical, the mean and
+worst word-level similarity to the html5lib output, and the files that
+differ most, so a corpus can be checked before switching to --parser lxml.
+
+Usage:
+    python compare_parsers.py INPUT_DIR [--parsers lxml] [--show 10]
+"""
+
+import os
+import sys
+import difflib
+import logging
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+import main
+
+
+def extracted_words(input_dir: str, filename: str, parser: str) -> Optional[List[str]]:
+    """Return the words of the cleaned main content, or None if extraction failed."""
+    options = main.ConversionOptions(output_format='md', engine='pandoc', parser=parser)
+    try:
+        document = main.extract_file(input_dir, filename, options)
+    except Exception:
+        return None
+    if document is None:
+        return None
+    return BeautifulSoup(document.clean_html, 'html.parser').get_text(' ').split()
+
+
+def similarity(reference: Optional[List[str]], candidate: Optional[List[str]]) -> float:
+    if reference is None or candidate is None:
+        return 1.0 if reference is candidate else 0.0
+    if reference == candidate:
+        return 1.0
+    return difflib.SequenceMatcher(None, reference, candidate, autojunk=False).ratio()
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Compare extracted output between HTML parser backends.")
+    parser.add_argument("input_dir", help="The directory containing source HTML files.")
+    parser.add_argument(
+        "--parsers",
+        nargs="+",
+        default=[p for p in main.PARSER_BACKENDS if p != 'html5lib'],
+        choices=main.PARSER_BACKENDS,
+        help="Backends to compare against html5lib (default: all others)."
+    )
+    parser.add_argument("--show", type=int, default=10, help="Number of most-different files to list (default: 10).")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input_dir):
+        print(f"Error: Input directory '{args.input_dir}' not found.", file=sys.stderr)
+        sys.exit(1)
+    for backend in args.parsers:
+        main.check_parser_dependency(backend)
+
+    # extract_file logs every file at INFO; only real problems are interesting here.
+    logging.basicConfig(level=logging.ERROR, format='%(levelname)s: %(message)s')
+
+    filenames = sorted(f for f in os.listdir(args.input_dir) if f.endswith(('.html', '.htm')))
+    if not filenames:
+        print(f"No HTML files found in '{args.input_dir}'.")
+        return
+
+    scores: Dict[str, List[Tuple[float, str]]] = {backend: [] for backend in args.parsers}
+    for filename in filenames:
+        reference = extracted_words(args.input_dir, filename, 'html5lib')
+        for backend in args.parsers:
+            candidate = extracted_words(args.input_dir, filename, backend)
+            scores[backend].append((similarity(reference, candidate), filename))
+
+    for backend, results in scores.items():
+        ratios = [ratio for ratio, _ in results]
+        identical = sum(1 for ratio in ratios if ratio == 1.0)
+        print(f"\n{'='*25} html5lib vs {backend} {'='*25}")
+        print(f"  - Files compared:           {len(results)}")
+        print(f"  - Identical extractions:    {identical} ({identical / len(results):.1%})")
+        print(f"  - Mean word similarity:     {sum(ratios) / len(ratios):.4f}")
+        print(f"  - Lowest word similarity:   {min(ratios):.4f}")
+        worst = sorted(result for result in results if result[0] < 1.0)[:args.show]
+        if worst:
+            print("  - Most different files:")
+            for ratio, filename in worst:
+                print(f"      {ratio:.4f}  {filename}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,92 @@
+#!/usr/bin/env node
+
+// Resident conversion worker for the html-to-text engine.
+//
+// Reads length-prefixed requests from stdin and writes length-prefixed
+// responses to stdout, one response per request, in order. Each frame is a
+// 4-byte big-endian byte length followed by a UTF-8 JSON payload:
+//
+//   request:  {"format": "md" | "txt", "html": "<p>...</p>"}
+//   response: {"ok": true, "output": "..."} or {"ok": false, "error": "..."}
+//
+// The worker exits when stdin closes.
+
+const path = require('path');
+const { execSync } = require('child_process');
+
+function requireGlobal(name) {
+    try {
+        return require(name);
+    } catch (error) {
+        // Not resolvable locally or via NODE_PATH; fall back to the global npm root
+    }
+    const roots = [];
+    if (process.env.APPDATA) {
+        roots.push(path.join(process.env.APPDATA, 'npm', 'node_modules'));
+    }
+    try {
+        roots.push(execSync('npm root -g', { stdio: ['ignore', 'pipe', 'ignore'] }).toString().trim());
+    } catch (error) {
+        // npm not on PATH; rely on the other candidates
+    }
+    for (const root of roots) {
+        try {
+            return require(path.join(root, name));
+        } catch (error) {
+            continue;
+        }
+    }
+    throw new Error(`Cannot find module '${name}'. Install it with: npm install -g ${name}`);
+}
+
+const converters = {};
+
+function getConverter(format) {
+    if (!converters[format]) {
+        if (format === 'md') {
+            converters[format] = requireGlobal('html-to-md');
+        } else if (format === 'txt') {
+            const { convert } = requireGlobal('html-to-text');
+            converters[format] = (html) => convert(html, { wordwrap: false });
+        } else {
+            throw new Error(`Invalid output format specified: ${format}`);
+        }
+    }
+    return converters[format];
+}
+
+function writeFrame(payload) {
+    const body = Buffer.from(JSON.stringify(payload), 'utf8');
+    const header = Buffer.alloc(4);
+    header.writeUInt32BE(body.length, 0);
+    process.stdout.write(Buffer.concat([header, body]));
+}
+
+function handleRequest(body) {
+    try {
+        const request = JSON.parse(body.toString('utf8'));
+        const output = getConverter(request.format)(request.html);
+        writeFrame({ ok: true, output: output });
+    } catch (error) {
+        writeFrame({ ok: false, error: error.message });
+    }
+}
+
+let buffer = Buffer.alloc(0);
+
+process.stdin.on('data', (chunk) => {
+    buffer = buffer.length ? Buffer.concat([buffer, chunk]) : chunk;
+    while (buffer.length >= 4) {
+        const length = buffer.readUInt32BE(0);
+        if (buffer.length < 4 + length) {
+            break;
+        }
+        const body = buffer.subarray(4, 4 + length);
+        buffer = buffer.subarray(4 + length);
+        handleRequest(body);
+    }
+});
+
+process.stdin.on('end', () => {
+    process.exit(0);
+});
@@ -1,44 +1,115 @@
 import os
+import io
+import gc
 import re
 import sys
+import json
+import queue
+import atexit
+import time
+import uuid
+import sqlite3
+import zlib
+import gzip
+import tarfile
+import zipfile
+import hashlib
+import mmap
+import struct
+import contextlib
+import codecs
 import shutil
 import subprocess
+import signal
 import argparse
 import logging
-from typing import Optional, Dict, List
+import heapq
+import fnmatch
+import itertools
+import collections
+import asyncio
+import threading
+import socketserver
+import http.server
+import urllib.parse
+import concurrent.futures
+from dataclasses import dataclass, field, replace
+from typing import Optional, Dict, List, Tuple, Iterable, Iterator, Generator, Deque, Union, BinaryIO
+from html.parser import HTMLParser
 from bs4 import BeautifulSoup, element
+from bs4.formatter import HTMLFormatter
 from tqdm import tqdm
 
 # --- Configuration ---
 VERSION: str = "2.0.0"
+# Part of every conversion cache key. Bump it in any change that alters converted output
+# (extraction, cleaning, native rendering, frontmatter...), or --cache serves stale text.
+CONVERTER_REVISION: int = 1
 MAX_FILE_SIZE_BYTES: int = 2 * 1024 * 1024  # 2 MB
 MIN_CONTENT_SCORE: int = 50  # Minimum score to be considered 'good' content
+CHECKPOINT_INTERVAL: int = 50  # Files between resume checkpoints
+ENGINE_TIMEOUT: float = 120.0  # Seconds one engine call (process or resident worker answer) may take
 ALLOWED_TAGS: List[str] = [
     'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
     'ul', 'ol', 'li', 'blockquote', 'pre', 'code',
     'table', 'tr', 'td', 'th', 'strong', 'em', 'a'
 ]
+PARSER_BACKENDS: List[str] = ['html5lib', 'lxml']
+CANDIDATE_TAGS: List[str] = ['div', 'article', 'main', 'section']
+STRIPPED_TAGS: List[str] = ['script', 'style', 'nav', 'footer', 'header', 'aside', 'form']
+SCORED_STRING_TYPES = (element.NavigableString, element.CData)
+HTML_FORMATTER = HTMLFormatter.REGISTRY['minimal']
+LEADING_NEWLINE_TAGS = ('pre', 'listing', 'textarea')
+RAWTEXT_TAGS = ('xmp', 'iframe', 'noembed', 'noframes')
+DEFAULT_INCLUDE_GLOBS: List[str] = ['*.html', '*.htm']
+ARCHIVE_GLOBS: List[str] = ['*.gz', '*.tgz', '*.zip', '*.tar', '*.tar.*', '*.warc']
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+PREFILTER_MIN_BYTES: int = 64 * 1024  # Default size from which --prefilter applies
+PIPELINE_STAGES: List[str] = ['read', 'cache', 'prefilter', 'degrade', 'parse', 'strip', 'prune', 'score', 'dedup', 'clean', 'engine', 'write']
+PROFILERS: List[str] = ['cprofile', 'pyinstrument']
+BOILERPLATE_MIN_PAGES: int = 5  # Pages a subtree must be seen on before --learn-boilerplate prunes it
+BOILERPLATE_CACHE_SIZE: int = 50000  # Subtree fingerprints remembered by --learn-boilerplate
+DEDUP_THRESHOLD: float = 0.9  # Estimated Jaccard similarity from which --dedup skips a page
+DEDUP_SHINGLE_WORDS: int = 5
+DEDUP_SIGNATURE_BINS: int = 64
+OVERSIZE_ACTIONS: List[str] = ['degrade', 'skip']
+TOKENIZERS: List[str] = ['estimate', 'tiktoken']
+CHARS_PER_TOKEN: int = 4  # Characters per token assumed by --tokenizer estimate
+TIKTOKEN_ENCODING: str = 'cl100k_base'
+# Used by the streaming text extractor for pages over the per-document limits. It skips the
+# same boilerplate as STRIPPED_TAGS, plus the parts of a page that never hold body text.
+DEGRADED_SKIPPED_TAGS = frozenset(STRIPPED_TAGS) | frozenset(['head', 'noscript', 'template', 'svg'])
+DEGRADED_BLOCK_TAGS = frozenset([
+    'p', 'div', 'br', 'hr', 'li', 'dt', 'dd', 'tr', 'table', 'pre', 'blockquote',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article', 'main', 'figcaption',
+])
 
-def setup_logging(output_dir: str, input_folder_name: str) -> None:
+_console_handler: Optional[logging.Handler] = None
+
+def setup_console_logging() -> None:
+    """Print errors to the console. Safe to call before setup_logging, e.g. for dependency checks."""
+    global _console_handler
+    if _console_handler is None:
+        _console_handler = logging.StreamHandler(sys.stderr)
+        _console_handler.setLevel(logging.ERROR)
+        _console_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+        logging.getLogger().addHandler(_console_handler)
+
+def setup_logging(output_dir: str, input_folder_name: str, append: bool = False) -> None:
     """Set up a logger to write to a file in the output directory."""
     log_filename = f"run_{input_folder_name}.log"
     log_filepath = os.path.join(output_dir, log_filename)
     
-    # Avoid adding handlers if they already exist (e.g., in interactive environments)
+    # Avoid adding a second log file if one already exists (e.g., in interactive environments).
+    # Only file handlers count: the console handler may already be installed by main().
     logger = logging.getLogger()
-    if not logger.handlers:
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            filename=log_filepath,
-            filemode='w'
-        )
-        # Also add a handler to print errors to the console
-        console_handler = logging.StreamHandler(sys.stderr)
-        console_handler.setLevel(logging.ERROR)
-        formatter = logging.Formatter('%(levelname)s: %(message)s')
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+    if not any(isinstance(handler, logging.FileHandler) for handler in logger.handlers):
+        file_handler = logging.FileHandler(log_filepath, mode='a' if append else 'w', encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(file_handler)
+        logger.setLevel(logging.INFO)
+    # Also print errors to the console
+    setup_console_logging()
 
 def check_pandoc_dependency() -> None:
     """Check if Pandoc is installed and exit if it's not."""
@@ -59,30 +130,46 @@ def check_html_to_text_dependency() -> None:
     # The actual dependency checking will happen during conversion
     logging.info("html-to-text engine dependencies check successful.")
 
+def check_parser_dependency(parser: str) -> None:
+    """Check that the selected HTML parser backend is importable and exit if it's not."""
+    if parser == 'lxml':
+        try:
+            import lxml  # noqa: F401
+        except ImportError:
+            logging.critical("FATAL ERROR: '--parser lxml' requires the 'lxml' package.")
+            logging.critical("Install it with: pip install lxml")
+            sys.exit(1)
+    logging.info(f"Parser backend '{parser}' is available.")
+
+def check_tokenizer_dependency(tokenizer: str) -> None:
+    """Check that the selected tokenizer is importable and exit if it's not."""
+    if tokenizer == 'tiktoken':
+        try:
+            import tiktoken  # noqa: F401
+        except ImportError:
+            logging.critical("FATAL ERROR: '--tokenizer tiktoken' requires the 'tiktoken' package.")
+            logging.critical("Install it with: pip install tiktoken")
+            sys.exit(1)
+    logging.info(f"Tokenizer '{tokenizer}' is available.")
+
 def check_dependencies(engine: str) -> None:
     """Check dependencies based on selected engine."""
     if engine == 'pandoc':
         check_pandoc_dependency()
     elif engine == 'html-to-text':
         check_html_to_text_dependency()
+    elif engine == 'native':
+        logging.info("native engine runs in-process; no external dependencies.")
     else:
         logging.critical(f"Unknown engine: {engine}")
         sys.exit(1)
 
-def get_content_score(tag: element.Tag) -> int:
-    """Calculate a 'content score' for a given HTML element."""
-    if not tag:
-        return 0
-    
-    score = 0
-    text = tag.get_text(separator=' ', strip=True)
-    score += len(text)
-    score += len(tag.find_all('p')) * 25
+def _score_from_counts(tag: element.Tag, text_length: int, paragraph_count: int, link_text_length: int) -> int:
+    """Combine pre-computed subtree counts with the tag's own name, class and id into a content score."""
+    score = text_length
+    score += paragraph_count * 25
 
-    links = tag.find_all('a')
-    link_text_length = sum(len(link.get_text(strip=True)) for link in links)
-    
-    if len(text) > 0 and (link_text_length / len(text)) > 0.4:
+    if text_length > 0 and (link_text_length / text_length) > 0.4:
         score -= 100
 
     class_id_string = ' '.join(tag.get('class', [])) + ' ' + (tag.get('id', '') or '')
@@ -97,12 +184,292 @@ def get_content_score(tag: element.Tag) -> int:
         
     return score
 
-def clean_html_for_llm(soup_tag: element.Tag) -> str:
-    """Surgically clean HTML by removing unwanted tags while preserving content structure."""
+def get_content_score(tag: element.Tag) -> int:
+    """Calculate a 'content score' for a given HTML element."""
+    if not tag:
+        return 0
+    
+    text = tag.get_text(separator=' ', strip=True)
+    links = tag.find_all('a')
+    link_text_length = sum(len(link.get_text(strip=True)) for link in links)
+    return _score_from_counts(tag, len(text), len(tag.find_all('p')), link_text_length)
+
+def score_candidates(soup: element.Tag) -> List[Tuple[element.Tag, int]]:
+    """Score every candidate element in one bottom-up pass over the tree.
+
+    Gives the same scores as calling get_content_score on each candidate, but
+    walks the tree once instead of once per candidate, so deeply nested pages
+    stay linear. Candidates are returned in document order.
+    """
+    # Per-tag running totals, keyed by id(): [stripped text length, non-empty
+    # string count, <p> descendants, text length inside <a> descendants].
+    totals: Dict[int, List[int]] = {}
+    scored: List[Tuple[element.Tag, int]] = []
+
+    # Reversed pre-order visits every node after all of its descendants.
+    for node in reversed(list(soup.descendants)):
+        parent_totals = totals.setdefault(id(node.parent), [0, 0, 0, 0])
+        if isinstance(node, element.NavigableString):
+            # get_text() only counts plain strings, not comments, doctypes etc.
+            if type(node) in SCORED_STRING_TYPES:
+                stripped_length = len(node.strip())
+                if stripped_length:
+                    parent_totals[0] += stripped_length
+                    parent_totals[1] += 1
+            continue
+
+        text_length, string_count, paragraph_count, link_text_length = totals.pop(id(node), (0, 0, 0, 0))
+        if node.name in CANDIDATE_TAGS:
+            # get_text(separator=' ') puts one space between consecutive strings.
+            joined_length = text_length + max(string_count - 1, 0)
+            scored.append((node, _score_from_counts(node, joined_length, paragraph_count, link_text_length)))
+
+        parent_totals[0] += text_length
+        parent_totals[1] += string_count
+        parent_totals[2] += paragraph_count + (node.name == 'p')
+        parent_totals[3] += link_text_length + (text_length if node.name == 'a' else 0)
+
+    scored.reverse()
+    return scored
+
+def fingerprint_candidates(soup: element.Tag) -> Tuple[List[Tuple[element.Tag, int, int]], int]:
+    """Fingerprint every candidate element in one bottom-up pass over the tree.
+
+    A fingerprint hashes the tag names and stripped strings of the subtree, so
+    a block rendered from the same site template gets the same fingerprint on
+    every page. Returns (candidate, fingerprint, text length) in document order
+    and the text length of the whole tree.
+    """
+    # Per-tag running values, keyed by id(): [child hashes in reverse order, stripped text length].
+    totals: Dict[int, List] = {}
+    fingerprinted: List[Tuple[element.Tag, int, int]] = []
+
+    for node in reversed(list(soup.descendants)):
+        parent_totals = totals.setdefault(id(node.parent), [[], 0])
+        if isinstance(node, element.NavigableString):
+            if type(node) in SCORED_STRING_TYPES:
+                text = node.strip()
+                if text:
+                    parent_totals[0].append(hash(text))
+                    parent_totals[1] += len(text)
+            continue
+
+        child_hashes, text_length = totals.pop(id(node), ([], 0))
+        fingerprint = hash((node.name, tuple(child_hashes)))
+        if node.name in CANDIDATE_TAGS:
+            fingerprinted.append((node, fingerprint, text_length))
+        parent_totals[0].append(fingerprint)
+        parent_totals[1] += text_length
+
+    fingerprinted.reverse()
+    return fingerprinted, totals.get(id(soup), [[], 0])[1]
+
+class BoilerplateFingerprints:
+    """LRU of candidate fingerprints and the number of pages each was seen on, for --learn-boilerplate.
+
+    Each job learns from the pages it converts, and with --workers every
+    worker keeps its own table; see JobState.
+    """
+
+    def __init__(self, min_pages: int = BOILERPLATE_MIN_PAGES, max_entries: int = BOILERPLATE_CACHE_SIZE) -> None:
+        self.min_pages = min_pages
+        self.max_entries = max_entries
+        self._pages: "collections.OrderedDict[int, int]" = collections.OrderedDict()
+
+    def is_boilerplate(self, fingerprint: int) -> bool:
+        return self._pages.get(fingerprint, 0) >= self.min_pages
+
+    def record(self, fingerprints: Iterable[int]) -> None:
+        """Count one page for each distinct fingerprint, evicting the least recently seen beyond max_entries."""
+        for fingerprint in set(fingerprints):
+            self._pages[fingerprint] = self._pages.pop(fingerprint, 0) + 1
+        while len(self._pages) > self.max_entries:
+            self._pages.popitem(last=False)
+
+def prune_boilerplate(soup: element.Tag, fingerprints: BoilerplateFingerprints) -> int:
+    """Remove candidate subtrees already seen on min_pages other pages, then learn this page's; return how many were removed."""
+    candidates, page_text_length = fingerprint_candidates(soup)
+    pruned = 0
+    for tag, fingerprint, text_length in candidates:
+        if tag.decomposed:
+            continue  # Inside a subtree pruned above
+        # A subtree holding most of the page's text is its content, even if other pages repeat it.
+        if fingerprints.is_boilerplate(fingerprint) and text_length * 2 <= page_text_length:
+            tag.decompose()
+            pruned += 1
+    fingerprints.record(fingerprint for _, fingerprint, _ in candidates)
+    return pruned
+
+_SHINGLE_WORD = re.compile(r'\w+')
+_EMPTY_BIN = 0xFFFFFFFF
+_SIGNATURE_FORMAT = f'<{DEDUP_SIGNATURE_BINS}I'
+
+def minhash_signature(text: str) -> Optional[bytes]:
+    """One-permutation MinHash of the word shingles of text, or None if it has no words.
+
+    Each DEDUP_SHINGLE_WORDS-word shingle is hashed once: the hash picks one of
+    DEDUP_SIGNATURE_BINS bins, which keeps the smallest value it is given, so
+    the share of equal bins between two pages estimates the Jaccard similarity
+    of their shingle sets.
+    """
+    words = _SHINGLE_WORD.findall(text.lower())
+    if not words:
+        return None
+    bins = [_EMPTY_BIN] * DEDUP_SIGNATURE_BINS
+    for start in range(max(len(words) - DEDUP_SHINGLE_WORDS + 1, 1)):
+        shingle = ' '.join(words[start:start + DEDUP_SHINGLE_WORDS]).encode('utf-8')
+        digest = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'little')
+        slot = digest % DEDUP_SIGNATURE_BINS
+        value = min(digest >> 32, _EMPTY_BIN - 1)
+        if value < bins[slot]:
+            bins[slot] = value
+    return struct.pack(_SIGNATURE_FORMAT, *bins)
+
+def signature_similarity(first: bytes, second: bytes) -> float:
+    """Estimated Jaccard similarity of two pages from their minhash_signature, ignoring bins empty in both."""
+    equal = filled = 0
+    for a, b in zip(struct.unpack(_SIGNATURE_FORMAT, first), struct.unpack(_SIGNATURE_FORMAT, second)):
+        if a != _EMPTY_BIN or b != _EMPTY_BIN:
+            filled += 1
+            equal += a == b
+    return equal / filled if filled else 1.0
+
+def _lsh_rows(threshold: float) -> int:
+    """Signature bins per LSH band for a similarity threshold.
+
+    Picks the most rows whose band collision point (rows/bins)^(1/rows) stays
+    0.1 below the threshold, so pages at the threshold share a band, and are
+    compared, with near certainty.
+    """
+    rows = 1
+    for candidate in (2, 4, 8, 16, 32):
+        if (candidate / DEDUP_SIGNATURE_BINS) ** (1 / candidate) <= threshold - 0.1:
+            rows = candidate
+    return rows
+
+class NearDuplicateIndex:
+    """In-memory MinHash LSH index of the pages a job has kept so far.
+
+    Signatures are cut into bands; a new page is compared only with the kept
+    pages sharing one of its bands, and is a near-duplicate of the most similar
+    one at or above the threshold. Every kept page costs about 2 KB.
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD) -> None:
+        self.threshold = threshold
+        self.rows = _lsh_rows(threshold)
+        self._band_size = self.rows * 4
+        self._empty_band = struct.pack(f'<{self.rows}I', *[_EMPTY_BIN] * self.rows)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(DEDUP_SIGNATURE_BINS // self.rows)]
+        self._names: List[str] = []
+        self._signatures: List[bytes] = []
+
+    def _bands(self, signature: bytes) -> List[bytes]:
+        return [signature[i * self._band_size:(i + 1) * self._band_size] for i in range(len(self._buckets))]
+
+    def match(self, signature: bytes) -> Optional[Tuple[str, float]]:
+        """Return (name, similarity) of the kept page this one nearly duplicates, or None."""
+        best: Optional[Tuple[str, float]] = None
+        compared = set()
+        for bucket, band in zip(self._buckets, self._bands(signature)):
+            if band == self._empty_band:
+                continue
+            for page in bucket.get(band, ()):
+                if page in compared:
+                    continue
+                compared.add(page)
+                similarity = signature_similarity(signature, self._signatures[page])
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (self._names[page], similarity)
+        return best
+
+    def add(self, name: str, signature: bytes) -> None:
+        """Keep a page, so later pages are compared with it; only pages that were converted should be added."""
+        page = len(self._names)
+        self._names.append(name)
+        self._signatures.append(signature)
+        for bucket, band in zip(self._buckets, self._bands(signature)):
+            if band != self._empty_band:
+                bucket.setdefault(band, []).append(page)
+
+def _format_start_tag(tag: element.Tag) -> str:
+    """Serialize a start tag exactly as BeautifulSoup's 'minimal' formatter does."""
+    attrs = []
+    for key, val in HTML_FORMATTER.attributes(tag):
+        if val is None:
+            attrs.append(key)
+            continue
+        if isinstance(val, (list, tuple)):
+            val = ' '.join(val)
+        elif not isinstance(val, str):
+            val = str(val)
+        attrs.append(f"{key}={HTML_FORMATTER.quoted_attribute_value(HTML_FORMATTER.attribute_value(val))}")
+    attribute_string = ' ' + ' '.join(attrs) if attrs else ''
+    return f"<{tag.name}{attribute_string}>"
+
+def _format_text(node: element.NavigableString) -> str:
+    """Serialize a text node the way it reads after clean_html_for_llm_reparse's round trip."""
+    if isinstance(node, element.PreformattedString):
+        # Comments and other markup-like strings keep their own delimiters.
+        return node.output_ready(HTML_FORMATTER)
+
+    text = str(node)
+    parent = node.parent
+    parent_name = parent.name if parent is not None else None
+    if '\r' in text:
+        # The HTML tokenizer normalizes line endings on the way back in.
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    if parent_name in LEADING_NEWLINE_TAGS and text.startswith('\n') and node.previous_sibling is None:
+        # The HTML parser drops a newline directly after <pre>, <listing> or <textarea>.
+        text = text[1:]
+    text = HTML_FORMATTER.substitute(text)
+    if parent_name in RAWTEXT_TAGS:
+        # Raw-text elements keep their serialized entities as literal text when re-parsed.
+        text = HTML_FORMATTER.substitute(text)
+    return text
+
+def clean_html_for_llm(soup_tag: element.Tag, parser: str = 'html5lib') -> str:
+    """Surgically clean HTML by removing unwanted tags while preserving content structure.
+
+    Walks the existing tree once and writes only ALLOWED_TAGS (with their
+    attributes) and text into a single buffer, instead of serializing the
+    element, re-parsing it and unwrapping disallowed tags one by one. The
+    result matches clean_html_for_llm_reparse. ``parser`` is accepted for
+    compatibility and no longer used, since nothing is re-parsed.
+    """
+    if not soup_tag:
+        return ""
+
+    out = io.StringIO()
+    out.write('<html>')
+    # Stack of (tag, was its start tag written) for the elements we are inside.
+    open_tags: List[Tuple[element.Tag, bool]] = []
+    for node in soup_tag.descendants:
+        parent = node.parent
+        while open_tags and open_tags[-1][0] is not parent:
+            closed_tag, written = open_tags.pop()
+            if written:
+                out.write(f"</{closed_tag.name}>")
+        if isinstance(node, element.Tag):
+            allowed = node.name in ALLOWED_TAGS
+            if allowed:
+                out.write(_format_start_tag(node))
+            open_tags.append((node, allowed))
+        else:
+            out.write(_format_text(node))
+    while open_tags:
+        closed_tag, written = open_tags.pop()
+        if written:
+            out.write(f"</{closed_tag.name}>")
+    out.write('</html>')
+    return out.getvalue()
+
+def clean_html_for_llm_reparse(soup_tag: element.Tag, parser: str = 'html5lib') -> str:
+    """Reference cleaner: serialize, re-parse and unwrap disallowed tags. Slower; kept to verify clean_html_for_llm."""
     if not soup_tag:
         return ""
     
-    clean_tag = BeautifulSoup(str(soup_tag), 'html5lib').find()
+    clean_tag = BeautifulSoup(str(soup_tag), parser).find()
     
     for tag in clean_tag.find_all(True):
         if tag.name not in ALLOWED_TAGS:
@@ -110,43 +477,145 @@ def clean_html_for_llm(soup_tag: element.Tag) -> str:
             
     return str(clean_tag)
 
-def convert_html_to_output_pandoc(html_string: str, output_format: str) -> Optional[str]:
-    """Use pandoc to convert an HTML string to the desired output format."""
-    if not html_string:
-        return None
-    
+def _pandoc_command(output_format: str) -> Optional[List[str]]:
+    """Return the pandoc command line for an output format, or None if the format is unknown."""
     if output_format == 'md':
-        command = ['pandoc', '-f', 'html', '-t', 'markdown-smart']
+        return ['pandoc', '-f', 'html', '-t', 'markdown-smart']
     elif output_format == 'txt':
-        command = ['pandoc', '-f', 'html', '-t', 'plain+smart', '--wrap=none', '--columns=9999']
+        return ['pandoc', '-f', 'html', '-t', 'plain+smart', '--wrap=none', '--columns=9999']
+    # This case should not be reached due to argparse choices
+    logging.error(f"Invalid output format specified: {output_format}")
+    return None
+
+# Engine calls are written once, as generators that yield each (command, input bytes)
+# they need run and are sent back (returncode, stdout, stderr), or have the error raised
+# into them. _run_engine drives them with blocking processes, _run_engine_async with
+# asyncio ones, so both pipelines handle engine output and failures identically.
+EngineCommand = Tuple[Union[List[str], str], bytes]
+EngineCall = Generator[EngineCommand, Tuple[int, bytes, bytes], object]
+
+def _communicate(process: subprocess.Popen, input_bytes: bytes) -> Tuple[bytes, bytes]:
+    """Run process.communicate, killing the engine and raising TimeoutExpired after ENGINE_TIMEOUT seconds."""
+    try:
+        return process.communicate(input=input_bytes, timeout=ENGINE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        raise
+
+def _run_command(command: Union[List[str], str], input_bytes: bytes) -> Tuple[int, bytes, bytes]:
+    """Run an engine command to completion; a string command runs through the shell."""
+    if not isinstance(command, str):
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    elif sys.platform == 'win32':
+        # Use cmd.exe explicitly on Windows to avoid bash issues
+        process = subprocess.Popen(f'cmd /c "{command}"', stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, shell=False)
     else:
-        # This case should not be reached due to argparse choices
-        logging.error(f"Invalid output format specified: {output_format}")
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, shell=True)
+    stdout, stderr = _communicate(process, input_bytes)
+    return process.returncode, stdout, stderr
+
+def _run_engine(call: EngineCall):
+    """Drive an engine call with blocking processes and return its result."""
+    try:
+        request = next(call)
+        while True:
+            try:
+                reply = _run_command(*request)
+            except Exception as e:
+                request = call.throw(e)
+            else:
+                request = call.send(reply)
+    except StopIteration as done:
+        return done.value
+
+def _pandoc_call(html_string: str, output_format: str) -> EngineCall:
+    if not html_string:
+        return None
+    
+    command = _pandoc_command(output_format)
+    if command is None:
         return None
 
     try:
-        process = subprocess.Popen(
-            command,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout, stderr = process.communicate(input=html_string.encode('utf-8'))
-        
-        if process.returncode != 0:
-            logging.error(f"Pandoc Error: {stderr.decode('utf-8', 'ignore')}")
-            return None
-            
-        return stdout.decode('utf-8')
+        returncode, stdout, stderr = yield command, html_string.encode('utf-8')
     except Exception as e:
         logging.error(f"An unexpected error occurred with Pandoc: {e}")
         return None
+    if returncode != 0:
+        logging.error(f"Pandoc Error: {stderr.decode('utf-8', 'ignore')}")
+        return None
+    return stdout.decode('utf-8')
 
-def convert_html_to_output_html_to_text(html_string: str, output_format: str) -> Optional[str]:
-    """Use html-to-text to convert an HTML string to the desired output format."""
-    if not html_string:
+def convert_html_to_output_pandoc(html_string: str, output_format: str) -> Optional[str]:
+    """Use pandoc to convert an HTML string to the desired output format."""
+    return _run_engine(_pandoc_call(html_string, output_format))
+
+def _pandoc_batch_input(html_strings: List[str]) -> Tuple[str, bytes]:
+    """Join documents into one pandoc input; return the separator token and the input bytes."""
+    # Each document is preceded by a paragraph holding a unique alphanumeric token,
+    # which both writers emit verbatim on a line of its own.
+    token = f"HTMLCONVBATCH{uuid.uuid4().hex}"
+    parts = []
+    for i, html_string in enumerate(html_strings):
+        inner = html_string
+        if inner.startswith('<html>') and inner.endswith('</html>'):
+            inner = inner[len('<html>'):-len('</html>')]
+        parts.append(f"<p>{token}N{i}</p>{inner}")
+    return token, ''.join(parts).encode('utf-8')
+
+def _split_pandoc_batch(output: bytes, token: str, count: int) -> Optional[List[str]]:
+    """Split batched pandoc output back into documents; return None if the split is ambiguous."""
+    pieces = re.split(rf"^[ \t]*{token}N(\d+)[ \t]*$", output.decode('utf-8'), flags=re.M)
+    # re.split yields [preamble, index0, text0, index1, text1, ...]
+    indices = [int(index) for index in pieces[1::2]]
+    if indices != list(range(count)) or pieces[0].strip():
+        logging.warning(f"Pandoc batch of {count} documents could not be split back into documents.")
         return None
-    
+    return pieces[2::2]
+
+def _pandoc_batch_call(html_strings: List[str], output_format: str) -> EngineCall:
+    """Convert several documents in one pandoc call; return None if pandoc fails or the split is ambiguous."""
+    command = _pandoc_command(output_format)
+    if command is None:
+        return None
+
+    token, batch_input = _pandoc_batch_input(html_strings)
+    try:
+        returncode, stdout, stderr = yield command, batch_input
+    except Exception as e:
+        logging.warning(f"Pandoc batch of {len(html_strings)} documents failed to run: {e}")
+        return None
+    if returncode != 0:
+        logging.warning(f"Pandoc batch of {len(html_strings)} documents failed: {stderr.decode('utf-8', 'ignore')}")
+        return None
+    return _split_pandoc_batch(stdout, token, len(html_strings))
+
+def _pandoc_bisect_call(html_strings: List[str], output_format: str) -> EngineCall:
+    """Convert documents with as few pandoc processes as possible, bisecting any batch that fails."""
+    if len(html_strings) <= 1:
+        outputs = []
+        for html_string in html_strings:
+            outputs.append((yield from _pandoc_call(html_string, output_format)))
+        return outputs
+
+    outputs = yield from _pandoc_batch_call(html_strings, output_format)
+    if outputs is not None:
+        return outputs
+
+    mid = len(html_strings) // 2
+    logging.warning(f"Bisecting failed pandoc batch into {mid} + {len(html_strings) - mid} documents.")
+    first = yield from _pandoc_bisect_call(html_strings[:mid], output_format)
+    return first + (yield from _pandoc_bisect_call(html_strings[mid:], output_format))
+
+def convert_html_batch_pandoc(html_strings: List[str], output_format: str) -> List[Optional[str]]:
+    """Convert documents with as few pandoc processes as possible, bisecting any batch that fails."""
+    return _run_engine(_pandoc_bisect_call(html_strings, output_format))
+
+def _html_to_text_commands(output_format: str) -> Optional[List[str]]:
+    """Shell commands to try, in order, for converting with html-to-text; None for an invalid format."""
     # Use different libraries based on output format
     if output_format == 'md':
         # Use html-to-md for Markdown output
@@ -164,200 +633,3211 @@ def convert_html_to_output_html_to_text(html_string: str, output_format: str) ->
     else:
         logging.error(f"Invalid output format specified: {output_format}")
         return None
+    return commands_to_try
+
+def _html_to_text_call(html_string: str, output_format: str) -> EngineCall:
+    if not html_string:
+        return None
+    
+    commands_to_try = _html_to_text_commands(output_format)
+    if commands_to_try is None:
+        return None
     
     for command in commands_to_try:
         try:
-            # Use cmd.exe explicitly on Windows to avoid bash issues
-            if sys.platform == 'win32':
-                process = subprocess.Popen(
-                    f'cmd /c "{command}"',
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    shell=False
-                )
-            else:
-                process = subprocess.Popen(
-                    command,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    shell=True
-                )
-            stdout, stderr = process.communicate(input=html_string.encode('utf-8'))
-            
-            
-            if process.returncode == 0:
-                return stdout.decode('utf-8')
-            else:
-                # Try next command
-                continue
-                
-        except Exception as e:
+            returncode, stdout, _ = yield command, html_string.encode('utf-8')
+        except Exception:
             # Try next command
             continue
+        if returncode == 0:
+            return stdout.decode('utf-8')
     
     # If we get here, all commands failed
     logging.error("html-to-text: All command variants failed")
     return None
 
+def convert_html_to_output_html_to_text(html_string: str, output_format: str) -> Optional[str]:
+    """Use html-to-text to convert an HTML string to the desired output format."""
+    return _run_engine(_html_to_text_call(html_string, output_format))
+
+# --- Native engine ---
+
+_WHITESPACE_RUN = re.compile(r'[ \t\n\r\f\xa0]+')
+_MD_SPECIAL_CHARS = re.compile(r'([\\`*\[\]])')
+_MD_UNDERSCORE = re.compile(r'(?<!\w)_|_(?!\w)')
+_MD_BLOCK_START = re.compile(r'([#>+-]|\d+[.)])(?=\s|$)')
+_HEADING_LEVELS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+
+class _NativeFrame:
+    """One open allowed element while rendering; collects (kind, value) parts from its children."""
+    __slots__ = ('tag', 'parts', 'preformatted')
+
+    def __init__(self, tag: Optional[element.Tag], preformatted: bool) -> None:
+        self.tag = tag
+        self.parts: List[Tuple[str, object]] = []
+        self.preformatted = preformatted
+
+def _escape_markdown(text: str) -> str:
+    text = _MD_SPECIAL_CHARS.sub(r'\\\1', text)
+    return _MD_UNDERSCORE.sub(r'\\_', text)
+
+def _inline_text(parts: List[Tuple[str, object]]) -> str:
+    """Flatten parts into one line of text, folding any nested blocks into the run."""
+    pieces = []
+    for kind, value in parts:
+        if kind == 'inline':
+            pieces.append(value)
+        elif kind == 'row':
+            pieces.append(' '.join(value))
+        else:
+            pieces.append(f" {value} ")
+    return _WHITESPACE_RUN.sub(' ', ''.join(pieces)).strip()
+
+def _blocks(parts: List[Tuple[str, object]], markdown: bool) -> List[str]:
+    """Group parts into block strings: runs of inline content become paragraphs."""
+    blocks: List[str] = []
+    run: List[Tuple[str, object]] = []
+
+    def flush() -> None:
+        paragraph = _inline_text(run)
+        run.clear()
+        if paragraph:
+            block_start = _MD_BLOCK_START.match(paragraph) if markdown else None
+            if block_start:
+                # '1.' and '1)' are escaped at the delimiter; a leading backslash would be shown as is.
+                split = block_start.end() - 1 if block_start.group(1)[0].isdigit() else 0
+                paragraph = paragraph[:split] + '\\' + paragraph[split:]
+            blocks.append(paragraph)
+
+    for kind, value in parts:
+        if kind == 'inline':
+            run.append((kind, value))
+            continue
+        flush()
+        if kind == 'row':
+            blocks.append(' | '.join(value))
+        elif value:
+            blocks.append(value)
+    flush()
+    return blocks
+
+def _wrap_inline(text: str, marker: str) -> str:
+    """Wrap the non-blank core of text in marker, keeping surrounding whitespace outside it."""
+    core = text.strip()
+    if not core:
+        return text
+    leading = text[:len(text) - len(text.lstrip())]
+    trailing = text[len(text.rstrip()):]
+    return f"{leading}{marker}{core}{marker}{trailing}"
+
+def _render_list(frame: _NativeFrame, markdown: bool) -> str:
+    ordered = frame.tag.name == 'ol'
+    lines: List[str] = []
+    number = 1
+    for kind, value in frame.parts:
+        if kind == 'item':
+            content = value
+        elif kind == 'inline' and not value.strip():
+            continue
+        else:
+            content = value if kind != 'inline' else _WHITESPACE_RUN.sub(' ', value).strip()
+        marker = f"{number}. " if ordered else "- "
+        number += 1
+        indent = ' ' * len(marker)
+        item_lines = content.split('\n') if content else ['']
+        lines.append(marker + item_lines[0])
+        lines.extend(indent + line if line else '' for line in item_lines[1:])
+    return '\n'.join(lines)
+
+def _render_table(frame: _NativeFrame, markdown: bool) -> str:
+    rows = [value for kind, value in frame.parts if kind == 'row']
+    if not rows:
+        return '\n\n'.join(_blocks(frame.parts, markdown))
+    width = max(len(cells) for cells in rows) or 1
+    if not markdown:
+        return '\n'.join(' | '.join(cells) for cells in rows)
+
+    def line(cells: List[str]) -> str:
+        cells = [cell.replace('|', '\\|') for cell in cells] + [''] * (width - len(cells))
+        return '| ' + ' | '.join(cells) + ' |'
+
+    out = [line(rows[0]), '| ' + ' | '.join(['---'] * width) + ' |']
+    out.extend(line(cells) for cells in rows[1:])
+    return '\n'.join(out)
+
+def _close_native_frame(frame: _NativeFrame, parent: _NativeFrame, markdown: bool) -> List[Tuple[str, object]]:
+    """Render a finished element and return the parts it contributes to its parent."""
+    name = frame.tag.name
+
+    if name == 'pre':
+        code = ''.join(value for kind, value in frame.parts if kind == 'inline').strip('\n')
+        if not code.strip():
+            return []
+        if not markdown:
+            return [('block', code)]
+        fence = '```'
+        while fence in code:
+            fence += '`'
+        return [('block', f"{fence}\n{code}\n{fence}")]
+
+    if frame.preformatted:
+        # Inline markup inside <pre> keeps only its text.
+        return [(kind, value) for kind, value in frame.parts]
+
+    if name in _HEADING_LEVELS:
+        text = _inline_text(frame.parts)
+        if not text:
+            return []
+        return [('block', f"{'#' * _HEADING_LEVELS[name]} {text}" if markdown else text)]
+
+    if name == 'p':
+        return [('block', block) for block in _blocks(frame.parts, markdown)]
+
+    if name in ('ul', 'ol'):
+        rendered = _render_list(frame, markdown)
+        return [('block', rendered)] if rendered.strip() else []
+
+    if name == 'li':
+        blocks = _blocks(frame.parts, markdown)
+        content = '\n'.join(blocks)
+        if parent.tag is not None and parent.tag.name in ('ul', 'ol'):
+            return [('item', content)]
+        return [('block', f"- {content}")] if content else []
+
+    if name == 'blockquote':
+        blocks = _blocks(frame.parts, markdown)
+        if not blocks:
+            return []
+        prefix = '> ' if markdown else '  '
+        quoted = '\n'.join(prefix + line if line else prefix.rstrip() for line in '\n\n'.join(blocks).split('\n'))
+        return [('block', quoted)]
+
+    if name == 'table':
+        rendered = _render_table(frame, markdown)
+        return [('block', rendered)] if rendered.strip() else []
+
+    if name == 'tr':
+        cells = [value for kind, value in frame.parts if kind == 'cell']
+        return [('row', cells)] if cells else []
+
+    if name in ('td', 'th'):
+        return [('cell', _inline_text(frame.parts))]
+
+    # Inline elements: strong, em, code, a.
+    if any(kind != 'inline' for kind, _ in frame.parts):
+        return frame.parts
+    text = ''.join(value for _, value in frame.parts)
+    if not markdown:
+        return [('inline', text)]
+    if name == 'strong':
+        return [('inline', _wrap_inline(text, '**'))]
+    if name == 'em':
+        return [('inline', _wrap_inline(text, '*'))]
+    if name == 'code':
+        raw = _WHITESPACE_RUN.sub(' ', frame.tag.get_text())
+        if not raw.strip():
+            return [('inline', text)]
+        fence = '`'
+        while fence in raw:
+            fence += '`'
+        padding = ' ' if raw.startswith('`') or raw.endswith('`') else ''
+        return [('inline', f"{fence}{padding}{raw.strip()}{padding}{fence}")]
+    if name == 'a':
+        href = frame.tag.get('href')
+        if isinstance(href, list):
+            href = ' '.join(href)
+        core = text.strip()
+        if not core:
+            return [('inline', text)]
+        if not href or href.startswith(('javascript:', '#')):
+            return [('inline', text)]
+        leading = text[:len(text) - len(text.lstrip())]
+        trailing = text[len(text.rstrip()):]
+        href = href.strip().replace(' ', '%20').replace('(', '%28').replace(')', '%29')
+        return [('inline', f"{leading}[{core}]({href}){trailing}")]
+    return [('inline', text)]
+
+def render_native(root: element.Tag, output_format: str) -> str:
+    """Render the ALLOWED_TAGS content under root as Markdown or plain text without any subprocess.
+
+    Tags outside ALLOWED_TAGS are transparent, exactly as clean_html_for_llm
+    unwraps them, so this can run on the chosen element directly. The walk
+    and the element stack are both iterative, so deeply nested div soup does
+    not hit the recursion limit.
+    """
+    markdown = output_format == 'md'
+    frames: List[_NativeFrame] = [_NativeFrame(None, False)]
+    # Every element we are inside, with the frame it opened if it is an allowed tag.
+    open_tags: List[Tuple[element.Tag, bool]] = []
+    for node in root.descendants:
+        parent = node.parent
+        while open_tags and open_tags[-1][0] is not parent:
+            _, has_frame = open_tags.pop()
+            if has_frame:
+                closed = frames.pop()
+                frames[-1].parts.extend(_close_native_frame(closed, frames[-1], markdown))
+
+        if isinstance(node, element.Tag):
+            allowed = node.name in ALLOWED_TAGS
+            if allowed:
+                frames.append(_NativeFrame(node, frames[-1].preformatted or node.name == 'pre'))
+            open_tags.append((node, allowed))
+            continue
+        if isinstance(node, element.PreformattedString):
+            continue
+        text = str(node)
+        if frames[-1].preformatted:
+            frames[-1].parts.append(('inline', text))
+        else:
+            text = _WHITESPACE_RUN.sub(' ', text)
+            frames[-1].parts.append(('inline', _escape_markdown(text) if markdown else text))
+
+    while len(frames) > 1:
+        closed = frames.pop()
+        frames[-1].parts.extend(_close_native_frame(closed, frames[-1], markdown))
+    return '\n\n'.join(_blocks(frames[0].parts, markdown)) + '\n'
+
+def convert_html_to_output_native(html_string: str, output_format: str) -> Optional[str]:
+    """Render cleaned HTML in-process with render_native."""
+    if not html_string:
+        return None
+    if output_format not in ('md', 'txt'):
+        logging.error(f"Invalid output format specified: {output_format}")
+        return None
+    return render_native(BeautifulSoup(html_string, 'html.parser'), output_format)
+
+class EngineWorker:
+    """A resident Node process running engine-worker.js, fed over a length-prefixed JSON protocol."""
+
+    def __init__(self, max_docs: int, timeout: float = ENGINE_TIMEOUT) -> None:
+        self.max_docs = max_docs
+        self.timeout = timeout
+        self.docs_converted = 0
+        self._process: Optional[subprocess.Popen] = None
+        self._responses: "queue.Queue[Optional[bytes]]" = queue.Queue()
+
+    def _start(self) -> None:
+        script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "engine-worker.js")
+        self._process = subprocess.Popen(
+            ['node', script_path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        self.docs_converted = 0
+        # Responses are read on a thread, so convert() can stop waiting for a worker that hangs.
+        self._responses = queue.Queue()
+        threading.Thread(target=self._read_responses, args=(self._process.stdout, self._responses),
+                         daemon=True).start()
+        logging.info(f"Started html-to-text engine worker (pid {self._process.pid}).")
+
+    @staticmethod
+    def _read_responses(stream: BinaryIO, responses: "queue.Queue[Optional[bytes]]") -> None:
+        """Put each length-prefixed response body on responses, then None once the stream ends."""
+        try:
+            while True:
+                header = stream.read(4)
+                if len(header) != 4:
+                    break
+                (length,) = struct.unpack('>I', header)
+                body = stream.read(length)
+                if len(body) != length:
+                    break
+                responses.put(body)
+        except (OSError, ValueError):
+            pass
+        responses.put(None)
+
+    def convert(self, html_string: str, output_format: str) -> Optional[str]:
+        """Convert one document, restarting the worker after max_docs documents, a crash or a timeout."""
+        if self._process is None or self._process.poll() is not None or self.docs_converted >= self.max_docs:
+            self.stop()
+            self._start()
+
+        body = json.dumps({"format": output_format, "html": html_string}).encode('utf-8')
+        try:
+            self._process.stdin.write(struct.pack('>I', len(body)) + body)
+            self._process.stdin.flush()
+            body = self._responses.get(timeout=self.timeout if self.timeout > 0 else None)
+            if body is None:
+                raise EOFError("engine worker closed its output stream")
+            response = json.loads(body.decode('utf-8'))
+        except queue.Empty:
+            logging.error(f"html-to-text engine worker did not answer within {self.timeout:g} seconds; restarting it.")
+            self._process.kill()
+            self.stop()
+            return None
+        except (OSError, EOFError, ValueError) as e:
+            returncode = self._process.poll()
+            logging.error(f"html-to-text engine worker crashed (exit code {returncode}): {e}")
+            self.stop()
+            return None
+
+        self.docs_converted += 1
+        if not response.get("ok"):
+            logging.error(f"html-to-text worker error: {response.get('error')}")
+            return None
+        return response.get("output")
+
+    def stop(self) -> None:
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+            self._process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self._process.kill()
+            self._process.wait()
+        self._process = None
+
+class EngineWorkerPool:
+    """A fixed set of EngineWorkers shared by the threads of one process."""
+
+    def __init__(self, size: int, max_docs: int) -> None:
+        self._idle: "queue.Queue[EngineWorker]" = queue.Queue()
+        self._workers = [EngineWorker(max_docs) for _ in range(max(size, 1))]
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    def convert(self, html_string: str, output_format: str) -> Optional[str]:
+        worker = self._idle.get()
+        try:
+            return worker.convert(html_string, output_format)
+        finally:
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.stop()
+
+_engine_pool: Optional[EngineWorkerPool] = None
+
+def start_engine_pool(size: int = 1, max_docs: int = 500) -> None:
+    """Route html-to-text conversions in this process through resident engine workers."""
+    global _engine_pool
+    if _engine_pool is None:
+        _engine_pool = EngineWorkerPool(size, max_docs)
+        atexit.register(stop_engine_pool)
+
+def stop_engine_pool() -> None:
+    global _engine_pool
+    if _engine_pool is not None:
+        _engine_pool.close()
+        _engine_pool = None
+
 def convert_html_to_output(html_string: str, output_format: str, engine: str) -> Optional[str]:
     """Dispatcher function to call the appropriate conversion engine."""
     if engine == 'pandoc':
         return convert_html_to_output_pandoc(html_string, output_format)
     elif engine == 'html-to-text':
+        if _engine_pool is not None:
+            return _engine_pool.convert(html_string, output_format) if html_string else None
         return convert_html_to_output_html_to_text(html_string, output_format)
+    elif engine == 'native':
+        return convert_html_to_output_native(html_string, output_format)
     else:
         logging.error(f"Unknown engine: {engine}")
         return None
 
-def process_html_files(input_dir: str, output_dir: str, output_format: str, engine: str) -> None:
-    """Orchestrate the HTML conversion process."""
-    if not os.path.isdir(input_dir):
-        print(f"Error: Input directory '{input_dir}' not found.", file=sys.stderr)
-        sys.exit(1)
+@dataclass
+class ConversionOptions:
+    """Per-job settings shared by every pipeline stage and shipped to worker processes."""
+    output_format: str = 'md'
+    engine: str = 'html-to-text'
+    persistent_engine: bool = False
+    engine_max_docs: int = 500
+    pandoc_batch_size: int = 1
+    pandoc_batch_bytes: int = 1024 * 1024
+    parser: str = 'html5lib'
+    cache_path: Optional[str] = None
+    prefilter: bool = False
+    prefilter_min_bytes: int = PREFILTER_MIN_BYTES
+    engine_concurrency: int = 1  # Engine calls kept in flight by the asyncio pipeline; 1 disables it
+    learn_boilerplate: bool = False
+    boilerplate_min_pages: int = BOILERPLATE_MIN_PAGES
+    boilerplate_cache_size: int = BOILERPLATE_CACHE_SIZE
+    # Per-document limits; 0 disables each. Pages over a limit are degraded or skipped per oversize_action.
+    max_input_bytes: int = 0
+    max_nodes: int = 0
+    document_timeout: float = 0.0  # Seconds for parsing, scoring and cleaning one page
+    oversize_action: str = 'degrade'  # 'degrade' to the streaming text extractor, or 'skip'
+    dedup: bool = False  # Skip pages that nearly duplicate one already converted by this job
+    dedup_threshold: float = DEDUP_THRESHOLD
+    chunk_tokens: int = 0  # Write documents as JSONL chunks of at most this many tokens; 0 writes plain parts
+    tokenizer: str = 'estimate'
 
-    os.makedirs(output_dir, exist_ok=True)
-    
-    input_folder_name = os.path.basename(os.path.normpath(input_dir))
-    setup_logging(output_dir, input_folder_name)
-    
-    all_files: List[str] = sorted([f for f in os.listdir(input_dir) if f.endswith(('.html', '.htm'))])
-    if not all_files:
-        logging.warning(f"No HTML files found in '{input_dir}'.")
-        return
+    def prefilters(self, size: int) -> bool:
+        """Whether a document of size bytes goes through prefilter_html before parsing."""
+        return self.prefilter and size >= self.prefilter_min_bytes
 
-    job_stats: Dict[str, int] = {"successful": 0, "failed": 0, "output_files": 1}
-    logging.info(f"Starting job. Found {len(all_files)} HTML files in '{input_dir}'. Output format: {output_format.upper()}. Engine: {engine}")
-    
-    output_filename_template = f"{input_folder_name}_output_{{}}.{output_format}"
-    output_filepath = os.path.join(output_dir, output_filename_template.format(job_stats["output_files"]))
-    
+@dataclass
+class ExtractedDocument:
+    """The cleaned main content of one page, ready for an engine."""
+    filename: str
+    page_title: str
+    clean_html: str
+    # Set instead of clean_html for the native engine, which renders the tree directly.
+    content_element: Optional[element.Tag] = None
+    source: Optional[str] = None  # Frontmatter 'source:' if it differs from filename
+    score: Optional[int] = None  # Content score of the best candidate, if any candidate was scored
+    element: Optional[Dict] = None  # Which element was converted; see ConversionResult.element
+    signature: Optional[bytes] = None  # minhash_signature of the element's text, with --dedup
+
+@dataclass
+class InputRecord:
+    """One HTML document read out of an archive, passed through the pipeline in place of a file path."""
+    name: str  # '<archive path>!<member>', unique within the job; used in logs and checkpoints
+    source: str  # Member name or WARC target URI, written as the frontmatter 'source:'
+    raw: bytes
+    error: Optional[str] = None  # Why the record could not be read; the record is then counted as failed
+
+InputItem = Union[str, InputRecord]
+
+def input_item_name(item: InputItem) -> str:
+    """The name an input item goes by in results, logs and checkpoints."""
+    return item.name if isinstance(item, InputRecord) else item
+
+@dataclass
+class ConversionResult:
+    """What the pipeline produced for one input file, archive record or in-memory page.
+
+    Returned by convert_document and iter_convert, and consumed by process_html_files.
+    """
+    filename: str  # Input path, archive record name or the name given to an in-memory page
+    content: Optional[str] = None  # Text to append to the output file; None if the file failed
+    page_title: Optional[str] = None
+    output_text: Optional[str] = None
+    score: Optional[int] = None
+    content_hash: Optional[str] = None  # SHA-256 of the stripped output_text, for the output index
+    # The converted element: {"tag", "id", "class", "candidates" scored, "fallback" to <body>}; None if cached.
+    element: Optional[Dict] = None
+    error: Optional[str] = None  # Why content is None
+    over_limit: Optional[str] = None  # The per-document limit the page exceeded; content is then degraded or None
+    duplicate_of: Optional[str] = None  # The page this one nearly duplicates, if --dedup skipped it
+    signature: Optional[bytes] = None  # minhash_signature of the extracted text, with --dedup
+    cache_key: Optional[str] = None
+    cached: bool = False
+    bytes_in: int = 0
+    timings: Dict[str, float] = field(default_factory=dict)  # Seconds spent in each PIPELINE_STAGES entry
+
+    @property
+    def ok(self) -> bool:
+        return self.content is not None
+
+    @property
+    def title(self) -> Optional[str]:
+        return self.page_title
+
+    @property
+    def text(self) -> Optional[str]:
+        """The converted text without frontmatter, or None if the conversion failed."""
+        return self.output_text.strip() if self.content is not None else None
+
+def _matches_any(relative_path: str, name: str, patterns: List[str]) -> bool:
+    """Match globs containing '/' against the relative path and all others against the bare name."""
+    return any(fnmatch.fnmatchcase(relative_path if '/' in pattern else name, pattern) for pattern in patterns)
+
+def iter_input_files(input_dir: str, recursive: bool = False, include: Optional[List[str]] = None,
+                     exclude: Optional[List[str]] = None, ordered: bool = True) -> Iterator[str]:
+    """Lazily yield input files as '/'-separated paths relative to input_dir.
+
+    With ordered=True each directory's entries are sorted by name and visited
+    depth-first, so the order is deterministic and only one directory listing
+    is held at a time. With ordered=False entries come straight from
+    os.scandir and nothing is buffered. Directories matching an exclude glob
+    are not descended into; symlinked directories are not followed.
+    """
+    include = include or DEFAULT_INCLUDE_GLOBS
+    exclude = exclude or []
+
+    def entries(directory: str) -> Iterator[os.DirEntry]:
+        try:
+            scanner = os.scandir(directory)
+        except OSError as e:
+            logging.error(f"Cannot read directory '{directory}': {e}")
+            return
+        with scanner:
+            if not ordered:
+                yield from scanner
+                return
+            listing = sorted(scanner, key=lambda entry: entry.name)
+        yield from listing
+
+    # Iterative depth-first walk: (directory iterator, relative prefix) per level.
+    stack = [(entries(input_dir), '')]
+    while stack:
+        entry = next(stack[-1][0], None)
+        if entry is None:
+            stack.pop()
+            continue
+        relative_path = stack[-1][1] + entry.name
+        if _matches_any(relative_path, entry.name, exclude):
+            continue
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            is_dir = False
+        if is_dir:
+            if recursive:
+                stack.append((entries(entry.path), relative_path + '/'))
+        elif _matches_any(relative_path, entry.name, include):
+            yield relative_path
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse an 'i/N' shard spec (0 <= i < N) for argparse."""
     try:
-        with open(output_filepath, 'w', encoding='utf-8') as out_file:
-            logging.info(f"Creating new output file: {output_filepath}")
-            pbar = tqdm(all_files, desc="Processing files", unit="file")
-            
-            for filename in pbar:
-                pbar.set_postfix_str(filename)
-                try:
-                    filepath = os.path.join(input_dir, filename)
-                    logging.info(f"Processing '{filename}'.")
-                    with open(filepath, 'r', encoding='utf-8-sig', errors='ignore') as f:
-                        soup = BeautifulSoup(f, 'html5lib')
-
-                    page_title_tag = soup.find('title')
-                    page_title = page_title_tag.get_text(strip=True) if page_title_tag else "No Title Found"
-
-                    for tag in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'form']):
-                        tag.decompose()
-                    
-                    candidates = {el: get_content_score(el) for el in soup.find_all(['div', 'article', 'main', 'section'])}
-                    
-                    html_to_process = None
-                    if candidates:
-                        best_candidate_element = max(candidates, key=candidates.get)
-                        best_score = candidates[best_candidate_element]
-                        if best_score < MIN_CONTENT_SCORE:
-                            logging.warning(f"Best score for {filename} is low ({best_score}). Falling back to <body>.")
-                            html_to_process = soup.find('body')
-                        else:
-                            logging.info(f"Found best candidate in '{filename}' with score {best_score}.")
-                            html_to_process = best_candidate_element
-                    else:
-                        logging.warning(f"No candidates found in {filename}. Falling back to <body>.")
-                        html_to_process = soup.find('body')
-
-                    if html_to_process:
-                        clean_html = clean_html_for_llm(html_to_process)
-                        output_text = convert_html_to_output(clean_html, output_format, engine)
-                        
-                        if output_text and output_text.strip():
-                            content_to_write = ""
-                            # Only add YAML frontmatter for Markdown files
-                            if output_format == 'md':
-                                safe_title = page_title.replace('\\', '\\\\').replace('"', '\\"')
-                                frontmatter = f"---\nsource: {filename}\ntitle: \"{safe_title}\"\n---\n\n"
-                                content_to_write += frontmatter
-                            
-                            content_to_write += f"{output_text.strip()}\n\n"
-                            
-                            current_size = out_file.tell()
-                            if current_size + len(content_to_write.encode('utf-8')) > MAX_FILE_SIZE_BYTES and current_size > 0:
-                                out_file.close()
-                                job_stats["output_files"] += 1
-                                output_filepath = os.path.join(output_dir, output_filename_template.format(job_stats["output_files"]))
-                                logging.info(f"Max file size reached. Creating new output file: {output_filepath}")
-                                out_file = open(output_filepath, 'w', encoding='utf-8')
-
-                            out_file.write(content_to_write)
-                            job_stats["successful"] += 1
-                        else:
-                            logging.error(f"Conversion resulted in empty output for {filename}.")
-                            job_stats["failed"] += 1
-                    else:
-                        logging.error(f"Failed to find any content to convert in {filename}.")
-                        job_stats["failed"] += 1
-
-                except Exception as e:
-                    logging.critical(f"CRITICAL ERROR processing {filename}: {e}", exc_info=True)
-                    job_stats["failed"] += 1
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}'; expected i/N, e.g. 0/4")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}'; i must be between 0 and N-1")
+    return index, count
 
-    except KeyboardInterrupt:
-        logging.warning("Process interrupted by user. Shutting down gracefully.")
-    finally:
-        summary = (
-            f"\n{'='*25} JOB SUMMARY {'='*25}\n"
-            f"  - Engine used:                {engine}\n"
-            f"  - Total HTML files scanned:   {len(all_files)}\n"
-            f"  - Successful extractions:     {job_stats['successful']}\n"
-            f"  - Failed extractions:         {job_stats['failed']}\n"
-            f"  - Total output files created: {job_stats['output_files']} (.{output_format})\n"
-            f"  - Detailed log saved to: '{os.path.join(output_dir, f'run_{input_folder_name}.log')}'\n"
-            f"{'='*65}"
-        )
-        print(summary)
-        logging.info("Job finished.")
-        logging.info(summary)
-        if job_stats["failed"] > 0:
-            sys.exit(1)
+def shard_of(path: str, shard_count: int) -> int:
+    """Assign a relative input path to a shard. Stable across machines, platforms and runs."""
+    digest = hashlib.sha1(path.replace(os.sep, '/').encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="A robust utility to extract and convert HTML content to Markdown or plain text.",
-        formatter_class=argparse.RawTextHelpFormatter
-    )
-    parser.add_argument("input_dir", help="The directory containing source HTML files.")
-    parser.add_argument("output_dir", help="The directory where output files will be saved.")
-    parser.add_argument(
-        "--format", 
-        choices=['md', 'txt'], 
-        default='md', 
-        help="The output file format:\n"
-             "  md  - Markdown (default)\n"
-             "  txt - Plain text"
-    )
-    parser.add_argument(
-        "--engine",
-        choices=['html-to-text', 'pandoc'],
-        default='html-to-text',
-        help="The conversion engine to use:\n"
-             "  html-to-text - Enterprise-grade HTML parser (default)\n"
-             "  pandoc       - Original Pandoc-based converter"
-    )
-    parser.add_argument(
-        "--version",
-        action="version",
+def select_shard(paths: Iterable[str], shard_index: int, shard_count: int) -> Iterator[Tuple[int, str]]:
+    """Yield (position in the full input order, path) for the paths that belong to one shard."""
+    for position, path in enumerate(paths):
+        if shard_of(path, shard_count) == shard_index:
+            yield position, path
+
+# --- Byte-level prefilter ---
+
+_PREFILTER_TOKEN = re.compile(rb'<(?:!--|[!?]|/(?![A-Za-z])|(/?)([A-Za-z][^\t\n\f\r />]*))')
+# The rest of a tag up to its '>'. Quotes are only allowed around attribute values, so
+# the odd markup that the tokenizer reads differently fails to match and aborts the filter.
+_TAG_REST = re.compile(rb'(?:[^>"\'=]|=[\t\n\f\r ]*"[^"]*"|=[\t\n\f\r ]*\'[^\']*\'|=)*>')
+_END_TAG_REST = re.compile(rb'[^>"\']*>')
+_COMMENT_CLOSE = re.compile(rb'--!?>')
+_SCRIPT_TOKEN = re.compile(rb'<!--|-->|<(/?)script(?=[\t\n\f\r />])', re.I)
+_RAW_TEXT_TAGS = (b'style', b'title', b'textarea', b'xmp', b'iframe', b'noembed', b'noframes')
+_RAW_TEXT_END = {name: re.compile(rb'</' + name + rb'[\t\n\f\r />]', re.I) for name in _RAW_TEXT_TAGS}
+_INTEGRATION_POINTS = {
+    b'svg': (b'foreignobject', b'desc', b'title'),
+    b'math': (b'mi', b'mo', b'mn', b'ms', b'mtext', b'annotation-xml'),
+}
+# Start tags the parser keeps in <head>; any other start tag opens <body>.
+_HEAD_TAGS = frozenset([
+    b'html', b'head', b'base', b'basefont', b'bgsound', b'link', b'meta', b'title', b'noscript', b'noframes',
+    b'style', b'script', b'template',
+])
+# The only start tags a <noscript> in <head> keeps; anything else, or text, breaks out of it into <body>.
+_HEAD_NOSCRIPT_TAGS = frozenset([b'link', b'meta', b'style'])
+_HTML_SPACE = b' \t\n\f\r'
+# HTML start tags that end SVG/MathML content early; see "parsing tokens in foreign content".
+_FOREIGN_BREAKOUT_TAGS = frozenset([
+    b'b', b'big', b'blockquote', b'body', b'br', b'center', b'code', b'dd', b'div', b'dl', b'dt', b'em',
+    b'embed', b'h1', b'h2', b'h3', b'h4', b'h5', b'h6', b'head', b'hr', b'i', b'img', b'li', b'listing',
+    b'menu', b'meta', b'nobr', b'ol', b'p', b'pre', b'ruby', b's', b'small', b'span', b'strong', b'strike',
+    b'sub', b'sup', b'table', b'tt', b'u', b'ul', b'var', b'font',
+])
+
+class _PrefilterAbort(Exception):
+    """Raised when the markup is too unusual to filter safely; the document is then parsed unfiltered."""
+
+def _comment_end(data, position: int) -> int:
+    """Index just past the comment whose '<!--' ends at position, or -1 if it runs to the end of the data."""
+    if data[position:position + 1] == b'>':
+        return position + 1
+    if data[position:position + 2] == b'->':
+        return position + 2
+    match = _COMMENT_CLOSE.search(data, position)
+    return match.end() if match else -1
+
+def _end_tag_close(data, position: int) -> int:
+    """Index just past the end tag starting at position."""
+    match = _END_TAG_REST.match(data, position)
+    if match is None:
+        raise _PrefilterAbort()
+    return match.end()
+
+def _raw_text_close(data, name: bytes, position: int) -> int:
+    """Index just past the end tag of the raw text element whose content starts at position, or -1."""
+    match = _RAW_TEXT_END[name].search(data, position)
+    return _end_tag_close(data, match.start()) if match else -1
+
+def _script_close(data, position: int) -> int:
+    """Index just past </script> for script content starting at position, or -1.
+
+    Follows the tokenizer's escaped and double-escaped script states, in which
+    '<!--<script>' hides the next '</script>'.
+    """
+    state = 0  # 0: script data, 1: escaped ('<!--' seen), 2: double escaped
+    while True:
+        match = _SCRIPT_TOKEN.search(data, position)
+        if match is None:
+            return -1
+        token = match.group(0)
+        if token == b'<!--':
+            if state == 0:
+                state = 1
+            position = match.end() - 2  # The dashes may also close it, as in '<!-->'
+            continue
+        if token == b'-->':
+            state = 0
+        elif match.group(1):
+            if state != 2:
+                return _end_tag_close(data, match.start())
+            state = 1
+        elif state == 1:
+            state = 2
+        position = match.end()
+
+def prefilter_html(data) -> bytes:
+    """Drop comments and <script>, <style>, <svg> and <noscript> blocks from raw HTML bytes.
+
+    data may be bytes or a read-only mmap. The scan follows the tokenizer rules
+    that matter for finding where those blocks end: quoted attribute values,
+    raw text and escaped script content, and SVG/MathML foreign content. Text
+    that the parser would keep is never removed: when the markup is too unusual
+    to be sure, the document is returned unchanged, and an unterminated block
+    is left for the parser. That includes a <noscript> in <head> holding more
+    than link, meta and style tags, and a <noscript> or <svg> inside <select>,
+    whose text the parser moves into the page instead of dropping it.
+    """
+    kept: List[bytes] = []
+    keep_from = 0  # Start of the region not yet copied to kept
+    position = 0
+    drop_start = -1  # Start of an open <noscript> or <svg> block, or -1
+    drop_tag = b''
+    drop_depth = 0
+    foreign_tag = b''  # Open <svg> or <math> element, whose content is foreign
+    foreign_depth = 0
+    integration_depth = 0  # Open HTML integration points inside the foreign element
+    in_head = True  # No start tag seen yet that opens <body>; text that would is not checked, so this may overshoot
+    head_noscript = False  # The open <noscript> block is in <head>
+    in_select = False  # Inside <select>, where the parser ignores <noscript> and <svg> tags and keeps their text
+
+    try:
+        while True:
+            match = _PREFILTER_TOKEN.search(data, position)
+            if match is None:
+                break
+            start = match.start()
+            name = match.group(2)
+            if head_noscript and data[position:start].strip(_HTML_SPACE):
+                raise _PrefilterAbort()  # Text breaks out of a <noscript> in <head>
+
+            if name is None:
+                if match.group(0) == b'<!--':
+                    end = _comment_end(data, match.end())
+                    if end < 0:
+                        break  # A comment to the end of the file drops the rest anyway
+                    if drop_start < 0:
+                        kept.append(data[keep_from:start])
+                        keep_from = end
+                    position = end
+                    continue
+                if foreign_tag and data[start:start + 9] == b'<![CDATA[':
+                    if integration_depth:
+                        raise _PrefilterAbort()
+                    end = data.find(b']]>', start + 9)
+                    if end < 0:
+                        break
+                    position = end + 3
+                    continue
+                # Doctype, processing instruction or bogus comment: runs to the next '>'.
+                end = data.find(b'>', start)
+                if end < 0:
+                    break
+                position = end + 1
+                continue
+
+            closing = bool(match.group(1))
+            name = name.lower()
+            rest = _TAG_REST.match(data, match.end())
+            if rest is None:
+                raise _PrefilterAbort()
+            tag_end = rest.end()
+            self_closing = data[tag_end - 2:tag_end - 1] == b'/'
+            position = tag_end
+
+            if foreign_tag:
+                integration_points = _INTEGRATION_POINTS[foreign_tag]
+                if closing:
+                    if name == foreign_tag:
+                        if integration_depth:
+                            raise _PrefilterAbort()
+                        foreign_depth -= 1
+                    elif name in integration_points:
+                        integration_depth = max(integration_depth - 1, 0)
+                    elif name in (b'p', b'br') and not integration_depth:
+                        raise _PrefilterAbort()
+                elif integration_depth and (name == b'script' or name == b'plaintext' or name in _RAW_TEXT_TAGS):
+                    raise _PrefilterAbort()
+                elif not integration_depth and name in _FOREIGN_BREAKOUT_TAGS:
+                    raise _PrefilterAbort()
+                elif self_closing:
+                    pass
+                elif name == foreign_tag:
+                    foreign_depth += 1
+                elif name in integration_points:
+                    integration_depth += 1
+                if foreign_depth == 0:
+                    if drop_tag == foreign_tag:
+                        kept.append(data[keep_from:drop_start])
+                        keep_from = tag_end
+                        drop_start = -1
+                        drop_tag = b''
+                    foreign_tag = b''
+                continue
+
+            if closing:
+                if name == b'select':
+                    in_select = False
+                if name == drop_tag:
+                    drop_depth -= 1
+                    if drop_depth == 0:
+                        kept.append(data[keep_from:drop_start])
+                        keep_from = tag_end
+                        drop_start = -1
+                        drop_tag = b''
+                        head_noscript = False
+                continue
+
+            if head_noscript and name not in _HEAD_NOSCRIPT_TAGS:
+                raise _PrefilterAbort()
+            if name not in _HEAD_TAGS and drop_start < 0:
+                in_head = False
+            if name == b'select':
+                if drop_start >= 0:
+                    raise _PrefilterAbort()  # The parser ignores </noscript> inside <select>
+                in_select = True
+
+            if name == b'script' or name == b'style':
+                end = _script_close(data, tag_end) if name == b'script' else _raw_text_close(data, name, tag_end)
+                if end < 0:
+                    break  # Unterminated: the rest of the file is script or style text
+                if drop_start < 0:
+                    kept.append(data[keep_from:start])
+                    keep_from = end
+                position = end
+            elif name in _RAW_TEXT_TAGS:
+                end = _raw_text_close(data, name, tag_end)
+                if end < 0:
+                    break
+                position = end
+            elif name == b'plaintext':
+                break
+            elif name == b'noscript' and not self_closing:
+                if drop_start < 0:
+                    if in_select:
+                        raise _PrefilterAbort()
+                    drop_start, drop_tag, drop_depth = start, name, 1
+                    head_noscript = in_head
+                elif drop_tag == name:
+                    drop_depth += 1
+            elif name in (b'svg', b'math'):
+                if drop_start >= 0:
+                    raise _PrefilterAbort()  # Foreign content inside <noscript>; not worth the bookkeeping
+                if in_select:
+                    raise _PrefilterAbort()  # The parser ignores <svg> inside <select> and keeps its text
+                if self_closing:
+                    if name == b'svg':
+                        kept.append(data[keep_from:start])
+                        keep_from = tag_end
+                    continue
+                foreign_tag, foreign_depth, integration_depth = name, 1, 0
+                if name == b'svg':
+                    drop_start, drop_tag = start, name
+    except _PrefilterAbort:
+        return bytes(data)
+
+    # An unclosed <noscript>/<svg> is kept from its start tag on.
+    kept.append(data[keep_from:])
+    return b''.join(kept)
+
+# --- Archive input ---
+
+def _is_archive(path: str) -> bool:
+    name = path.rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in ARCHIVE_GLOBS)
+
+def _iter_zip(path: str, name: str, include: List[str], exclude: List[str]) -> Iterator[InputRecord]:
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            member_name = info.filename.rsplit('/', 1)[-1]
+            if info.is_dir() or _matches_any(info.filename, member_name, exclude):
+                continue
+            if _matches_any(info.filename, member_name, include):
+                with archive.open(info) as member:
+                    yield InputRecord(f"{name}!{info.filename}", info.filename, member.read())
+
+def _iter_tar(path: str, name: str, include: List[str], exclude: List[str]) -> Iterator[InputRecord]:
+    # Stream mode ('r|*') decompresses front to back without seeking or an index.
+    with tarfile.open(path, 'r|*') as archive:
+        for info in archive:
+            member_name = info.name.rsplit('/', 1)[-1]
+            if not info.isfile() or _matches_any(info.name, member_name, exclude):
+                continue
+            if _matches_any(info.name, member_name, include):
+                member = archive.extractfile(info)
+                yield InputRecord(f"{name}!{info.name}", info.name, member.read())
+
+def _skip_bytes(stream: BinaryIO, count: int) -> None:
+    while count > 0:
+        chunk = stream.read(min(count, 1024 * 1024))
+        if not chunk:
+            break
+        count -= len(chunk)
+
+def _decode_content(body: bytes, encoding: str) -> bytes:
+    """Undo an HTTP Content-Encoding; raises ValueError for encodings other than gzip and deflate."""
+    if encoding in ('', 'identity'):
+        return body
+    try:
+        if encoding in ('gzip', 'x-gzip'):
+            return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if encoding == 'deflate':
+            try:
+                return zlib.decompress(body)
+            except zlib.error:
+                return zlib.decompress(body, -zlib.MAX_WBITS)
+    except zlib.error as e:
+        raise ValueError(f"corrupt {encoding} body: {e}") from None
+    raise ValueError(f"unsupported Content-Encoding '{encoding}'")
+
+def _http_payload(stream: BinaryIO, length: int) -> Optional[bytes]:
+    """Read an HTTP response block of length bytes and return its decoded body if it is HTML.
+
+    Only the status line and headers are read before deciding, so non-HTML
+    responses (images, PDFs, ...) are skipped without being held in memory.
+    The whole block is consumed before a body that cannot be decoded raises ValueError.
+    """
+    consumed = 0
+    headers: Dict[str, str] = {}
+    while consumed < length:
+        line = stream.readline(length - consumed)
+        consumed += len(line)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, separator, value = line.decode('latin-1').partition(':')
+        if separator:
+            headers[key.strip().lower()] = value.strip().lower()
+    if not headers.get('content-type', '').startswith(HTML_CONTENT_TYPES):
+        _skip_bytes(stream, length - consumed)
+        return None
+
+    body = stream.read(length - consumed)
+    if 'chunked' in headers.get('transfer-encoding', ''):
+        chunks, position = [], 0
+        while True:
+            line_end = body.find(b'\r\n', position)
+            try:
+                size = int(body[position:line_end].split(b';')[0], 16) if line_end >= 0 else 0
+            except ValueError:
+                size = 0
+            if size == 0:
+                break
+            chunks.append(body[line_end + 2:line_end + 2 + size])
+            position = line_end + 2 + size + 2
+        body = b''.join(chunks)
+    return _decode_content(body, headers.get('content-encoding', ''))
+
+def _iter_warc(stream: BinaryIO, name: str) -> Iterator[InputRecord]:
+    """Yield the HTML response and resource records of a (decompressed) WARC stream."""
+    while True:
+        line = stream.readline()
+        if not line:
+            return
+        if not line.strip():
+            continue  # Blank lines between records
+        if not line.startswith(b'WARC/'):
+            raise ValueError(f"expected a WARC record header, got {line[:40]!r}")
+        headers: Dict[str, str] = {}
+        for line in iter(stream.readline, b''):
+            if line in (b'\r\n', b'\n'):
+                break
+            key, _, value = line.decode('utf-8', errors='replace').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', '0'))
+        record_type = headers.get('warc-type', '')
+        content_type = headers.get('content-type', '').lower()
+        uri = headers.get('warc-target-uri', '').strip('<>')
+
+        payload = None
+        if record_type == 'response' and content_type.startswith('application/http'):
+            try:
+                payload = _http_payload(stream, length)
+            except ValueError as e:
+                logging.error(f"Failed to read WARC record '{uri}' in '{name}': {e}")
+                yield InputRecord(f"{name}!{uri}", uri or name, b'', error=str(e))
+                continue
+        elif record_type == 'resource' and content_type.startswith(HTML_CONTENT_TYPES):
+            payload = stream.read(length)
+        else:
+            _skip_bytes(stream, length)
+        if payload is not None:
+            yield InputRecord(f"{name}!{uri}", uri or name, payload)
+
+def iter_archive_records(input_dir: str, path: str, include: Optional[List[str]] = None,
+                         exclude: Optional[List[str]] = None) -> Iterator[InputRecord]:
+    """Stream the HTML documents inside one archive without extracting it to disk.
+
+    Zip and tar members and the content of a single-file .gz are matched
+    against the include/exclude globs; WARC records are selected by content type.
+    """
+    include = include or DEFAULT_INCLUDE_GLOBS
+    exclude = exclude or []
+    full_path = os.path.join(input_dir, path)
+    lower = path.lower()
+    if lower.endswith(('.warc', '.warc.gz')):
+        opener = gzip.open if lower.endswith('.gz') else open
+        with opener(full_path, 'rb') as stream:
+            yield from _iter_warc(stream, path)
+    elif lower.endswith('.zip'):
+        yield from _iter_zip(full_path, path, include, exclude)
+    elif lower.endswith(('.tar', '.tgz')) or '.tar.' in lower:
+        yield from _iter_tar(full_path, path, include, exclude)
+    elif lower.endswith('.gz'):
+        inner = path[:-3]
+        inner_name = inner.rsplit('/', 1)[-1]
+        if _matches_any(inner, inner_name, include) and not _matches_any(inner, inner_name, exclude):
+            with gzip.open(full_path, 'rb') as f:
+                yield InputRecord(path, inner, f.read())
+
+def iter_input_items(input_dir: str, paths: Iterable[str], include: Optional[List[str]] = None,
+                     exclude: Optional[List[str]] = None) -> Iterator[InputItem]:
+    """Pass plain file paths through and expand archives into their HTML records.
+
+    A broken archive is logged and skipped; the records read before the error are kept.
+    """
+    for path in paths:
+        if not _is_archive(path):
+            yield path
+            continue
+        try:
+            yield from iter_archive_records(input_dir, path, include, exclude)
+        except (OSError, EOFError, ValueError, zlib.error, zipfile.BadZipFile, tarfile.TarError) as e:
+            logging.error(f"Failed to read archive '{path}': {e}")
+
+def read_input_file(input_dir: str, filename: str) -> bytes:
+    with open(os.path.join(input_dir, filename), 'rb') as f:
+        return f.read()
+
+@contextlib.contextmanager
+def open_input(input_dir: str, item: InputItem, options: ConversionOptions) -> Iterator[Union[bytes, mmap.mmap]]:
+    """Yield the raw bytes of a file or archive record.
+
+    Files that will be prefiltered are memory-mapped instead of read, so the
+    prefilter scans the page cache directly and only the kept bytes are copied.
+    """
+    if isinstance(item, InputRecord):
+        yield item.raw
+        return
+    with open(os.path.join(input_dir, item), 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0 or not options.prefilters(size):
+            yield f.read()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+def decode_html(raw: bytes) -> str:
+    """Decode raw file bytes the way open(..., encoding='utf-8-sig', errors='ignore') reads them."""
+    text = raw.decode('utf-8-sig', errors='ignore')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+class _StreamingTextExtractor(HTMLParser):
+    """Collect a page's title and visible text as paragraphs without building a tree."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.title_parts: List[str] = []
+        self.blocks: List[str] = []
+        self._line: List[str] = []
+        self._skip_depth = 0
+        self._in_title = False
+        self._title_done = False  # Like soup.find('title'), only the first <title> counts
+
+    def handle_starttag(self, tag: str, attrs) -> None:
+        if tag == 'title':
+            self._in_title = not self._title_done
+        elif tag in DEGRADED_SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in DEGRADED_BLOCK_TAGS:
+            self.end_block()
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == 'title':
+            self._title_done = self._title_done or self._in_title
+            self._in_title = False
+        elif tag in DEGRADED_SKIPPED_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in DEGRADED_BLOCK_TAGS:
+            self.end_block()
+
+    def handle_data(self, data: str) -> None:
+        if self._in_title:
+            self.title_parts.append(data)
+        elif not self._skip_depth:
+            self._line.append(data)
+
+    def end_block(self) -> None:
+        text = ' '.join(''.join(self._line).split())
+        if text:
+            self.blocks.append(text)
+        self._line = []
+
+def extract_text_streaming(raw: bytes, chunk_size: int = 1024 * 1024) -> Tuple[str, str]:
+    """Return the title and plain text of a page, decoding and parsing it chunk by chunk.
+
+    The fast path for pages over the per-document limits: memory grows with the
+    text kept, not with the markup, and time is linear in the input size.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='ignore')
+    extractor = _StreamingTextExtractor()
+    view = memoryview(raw)
+    for start in range(0, len(view), chunk_size):
+        extractor.feed(decoder.decode(view[start:start + chunk_size]))
+    extractor.feed(decoder.decode(b'', final=True))
+    extractor.close()
+    extractor.end_block()
+    page_title = ' '.join(''.join(extractor.title_parts).split()) or "No Title Found"
+    return page_title, '\n\n'.join(extractor.blocks)
+
+def over_limits(raw: bytes, options: ConversionOptions) -> Optional[str]:
+    """Describe which per-document size limit a page exceeds, or return None if it is within them.
+
+    The node count is estimated from the number of '<' bytes, which bounds the
+    tags and comments a parser could create without having to parse the page.
+    """
+    if options.max_input_bytes and len(raw) > options.max_input_bytes:
+        return f"is {len(raw):,} bytes, over the {options.max_input_bytes:,} byte limit"
+    if options.max_nodes:
+        nodes = raw.count(b'<')
+        if nodes > options.max_nodes:
+            return f"has about {nodes:,} tags, over the {options.max_nodes:,} node limit"
+    return None
+
+class DocumentTimeout(BaseException):
+    """Raised when a page's parsing, scoring and cleaning runs past --doc-timeout.
+
+    A BaseException, like KeyboardInterrupt, so handlers for ordinary errors along the way do not swallow it.
+    """
+
+def _raise_document_timeout(signum, frame) -> None:
+    raise DocumentTimeout()
+
+@contextlib.contextmanager
+def document_deadline(seconds: float) -> Iterator[None]:
+    """Raise DocumentTimeout inside the block once it has run for seconds.
+
+    Uses SIGALRM, so it only applies in the main thread on Unix, which is
+    where the CLI and its worker processes extract pages; elsewhere the block
+    runs without a limit.
+    """
+    if (seconds <= 0 or not hasattr(signal, 'setitimer')
+            or threading.current_thread() is not threading.main_thread()):
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _raise_document_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def release_tree(tag: Optional[element.Tag]) -> None:
+    """Decompose the whole parse tree a tag belongs to.
+
+    Parent and child links make every tree a web of reference cycles, so
+    without this a finished page's tree waits for the cyclic garbage collector
+    and peak memory climbs with the pages converted between collections.
+    """
+    if tag is None:
+        return
+    while tag.parent is not None:
+        tag = tag.parent
+    tag.decompose()
+
+def _lap(timings: Optional[Dict[str, float]], stage: str, start: float) -> float:
+    """Add the time since start to a stage and return the current time, so laps can be chained."""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (now - start)
+    return now
+
+class JobState:
+    """What a job learns from its pages as it goes: the --learn-boilerplate fingerprint
+    table and the --dedup index of the pages kept so far.
+
+    Every job starts with a fresh one; with --workers, each worker process
+    keeps its own besides the parent's.
+    """
+
+    def __init__(self, options: ConversionOptions) -> None:
+        self.boilerplate = BoilerplateFingerprints(options.boilerplate_min_pages, options.boilerplate_cache_size)
+        self.near_duplicates = NearDuplicateIndex(options.dedup_threshold)
+
+def extract_document(filename: str, raw: bytes, options: ConversionOptions,
+                     timings: Optional[Dict[str, float]] = None,
+                     state: Optional[JobState] = None) -> Optional[ExtractedDocument]:
+    """Parse one page, pick its main content element and clean it; return None if there is nothing to convert.
+
+    If timings is given, the seconds spent parsing, stripping, scoring and cleaning are added to it.
+    With --learn-boilerplate, blocks are pruned against the pages state has seen, and this page is
+    recorded in it.
+    """
+    logging.info(f"Processing '{filename}'.")
+    lap = time.perf_counter()
+    soup = BeautifulSoup(decode_html(raw), options.parser)
+    lap = _lap(timings, 'parse', lap)
+
+    page_title_tag = soup.find('title')
+    page_title = page_title_tag.get_text(strip=True) if page_title_tag else "No Title Found"
+
+    for tag in soup(STRIPPED_TAGS):
+        tag.decompose()
+    lap = _lap(timings, 'strip', lap)
+
+    if options.learn_boilerplate:
+        state = state or JobState(options)
+        pruned = prune_boilerplate(soup, state.boilerplate)
+        if pruned:
+            logging.info(f"Pruned {pruned} boilerplate blocks from '{filename}'.")
+        lap = _lap(timings, 'prune', lap)
+
+    candidates = score_candidates(soup)
+    lap = _lap(timings, 'score', lap)
+
+    html_to_process = None
+    best_score = None
+    fallback = True
+    if candidates:
+        best_candidate_element, best_score = max(candidates, key=lambda candidate: candidate[1])
+        if best_score < MIN_CONTENT_SCORE:
+            logging.warning(f"Best score for {filename} is low ({best_score}). Falling back to <body>.")
+            html_to_process = soup.find('body')
+        else:
+            logging.info(f"Found best candidate in '{filename}' with score {best_score}.")
+            html_to_process = best_candidate_element
+            fallback = False
+    else:
+        logging.warning(f"No candidates found in {filename}. Falling back to <body>.")
+        html_to_process = soup.find('body')
+
+    if not html_to_process:
+        logging.error(f"Failed to find any content to convert in {filename}.")
+        release_tree(soup)
+        return None
+
+    element_stats = {
+        "tag": html_to_process.name,
+        "id": html_to_process.get('id'),
+        "class": html_to_process.get('class', []),
+        "candidates": len(candidates),
+        "fallback": fallback,
+    }
+    signature = None
+    if options.dedup:
+        signature = minhash_signature(html_to_process.get_text(' '))
+        lap = _lap(timings, 'dedup', lap)
+    if options.engine == 'native':
+        # The caller releases the tree once the engine has rendered it.
+        return ExtractedDocument(filename, page_title, "", content_element=html_to_process, score=best_score,
+                                 element=element_stats, signature=signature)
+    clean_html = clean_html_for_llm(html_to_process, options.parser)
+    release_tree(soup)
+    _lap(timings, 'clean', lap)
+    return ExtractedDocument(filename, page_title, clean_html, score=best_score, element=element_stats,
+                             signature=signature)
+
+def extract_file(input_dir: str, filename: str, options: ConversionOptions) -> Optional[ExtractedDocument]:
+    """Read one file from disk and run extract_document on it."""
+    return extract_document(filename, read_input_file(input_dir, filename), options)
+
+_tiktoken_encoding = None
+
+def count_tokens(text: str, tokenizer: str = 'estimate') -> int:
+    """Count the tokens in text with tiktoken, or estimate them as one per CHARS_PER_TOKEN characters."""
+    if tokenizer == 'tiktoken':
+        global _tiktoken_encoding
+        if _tiktoken_encoding is None:
+            import tiktoken
+            _tiktoken_encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        return len(_tiktoken_encoding.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+_CHUNK_SEPARATORS = ('\n\n', '\n', ' ')  # Paragraphs, then lines, then words
+_MD_HEADING = re.compile(r'#{1,6}\s')
+
+def _text_blocks(text: str) -> List[str]:
+    """Split text into paragraphs at blank lines, keeping fenced code blocks whole."""
+    blocks: List[str] = []
+    lines: List[str] = []
+    fenced = False
+    for line in text.split('\n'):
+        if line.lstrip().startswith(('```', '~~~')):
+            fenced = not fenced
+        if line.strip() or fenced:
+            lines.append(line)
+        elif lines:
+            blocks.append('\n'.join(lines))
+            lines = []
+    if lines:
+        blocks.append('\n'.join(lines))
+    return blocks
+
+def _pack_pieces(pieces: List[str], level: int, max_tokens: int, tokenizer: str) -> Iterator[Tuple[str, int]]:
+    """Greedily join pieces with _CHUNK_SEPARATORS[level] into chunks of at most max_tokens."""
+    separator = _CHUNK_SEPARATORS[level]
+    separator_tokens = count_tokens(separator, tokenizer)
+    chunk: List[str] = []
+    chunk_tokens = 0
+    for piece in pieces:
+        tokens = count_tokens(piece, tokenizer)
+        if tokens > max_tokens:
+            if chunk:
+                yield separator.join(chunk), chunk_tokens
+                chunk, chunk_tokens = [], 0
+            yield from _split_oversized(piece, level + 1, max_tokens, tokenizer)
+            continue
+        if chunk:
+            # Start a new chunk if this piece would overflow it, or at a heading once it is half full.
+            if (chunk_tokens + separator_tokens + tokens > max_tokens
+                    or (level == 0 and chunk_tokens >= max_tokens // 2 and _MD_HEADING.match(piece))):
+                yield separator.join(chunk), chunk_tokens
+                chunk, chunk_tokens = [], 0
+            else:
+                chunk_tokens += separator_tokens
+        chunk.append(piece)
+        chunk_tokens += tokens
+    if chunk:
+        yield separator.join(chunk), chunk_tokens
+
+def _split_oversized(text: str, level: int, max_tokens: int, tokenizer: str) -> Iterator[Tuple[str, int]]:
+    """Split a piece over max_tokens at the first finer separator it contains, or else by characters."""
+    for finer in range(level, len(_CHUNK_SEPARATORS)):
+        pieces = text.split(_CHUNK_SEPARATORS[finer])
+        if len(pieces) > 1:
+            yield from _pack_pieces(pieces, finer, max_tokens, tokenizer)
+            return
+    start = 0
+    while start < len(text):
+        piece = text[start:start + max_tokens * CHARS_PER_TOKEN]
+        tokens = count_tokens(piece, tokenizer)
+        while tokens > max_tokens and len(piece) > 1:
+            piece = piece[:max(len(piece) * max_tokens // tokens, 1)]
+            tokens = count_tokens(piece, tokenizer)
+        yield piece, tokens
+        start += len(piece)
+
+def chunk_text(text: str, max_tokens: int, tokenizer: str = 'estimate') -> Iterator[Tuple[str, int]]:
+    """Split text into chunks of at most max_tokens tokens, yielding (chunk, tokens).
+
+    Chunks break between paragraphs, and start at a Markdown heading once they
+    are half full. A paragraph over the budget on its own is split at line
+    breaks, then at spaces, then by characters. Each piece is counted once and
+    a chunk's size is the running sum of its pieces and separators, so the
+    count can differ slightly from tokenizing the joined chunk with tiktoken.
+    """
+    return _pack_pieces(_text_blocks(text), 0, max(max_tokens, 1), tokenizer)
+
+def render_chunks(document: ExtractedDocument, output_text: str, options: ConversionOptions) -> str:
+    """Build the JSONL lines written for one document with --chunk-tokens, one line per chunk."""
+    chunks = list(chunk_text(output_text.strip(), options.chunk_tokens, options.tokenizer))
+    source = document.source or document.filename
+    lines = [
+        json.dumps({"source": source, "title": document.page_title, "chunk": number, "chunks": len(chunks),
+                    "tokens": tokens, "text": text}, ensure_ascii=False, separators=(',', ':'))
+        for number, (text, tokens) in enumerate(chunks)
+    ]
+    return '\n'.join(lines) + '\n'
+
+def render_document(document: ExtractedDocument, output_text: Optional[str], options: ConversionOptions) -> Optional[str]:
+    """Build the text written to the output file for one converted document, or None if the output is empty."""
+    if not (output_text and output_text.strip()):
+        logging.error(f"Conversion resulted in empty output for {document.filename}.")
+        return None
+    if options.chunk_tokens:
+        return render_chunks(document, output_text, options)
+
+    content_to_write = ""
+    # Only add YAML frontmatter for Markdown files
+    if options.output_format == 'md':
+        safe_title = document.page_title.replace('\\', '\\\\').replace('"', '\\"')
+        frontmatter = f"---\nsource: {document.source or document.filename}\ntitle: \"{safe_title}\"\n---\n\n"
+        content_to_write += frontmatter
+
+    content_to_write += f"{output_text.strip()}\n\n"
+    return content_to_write
+
+def _finish_result(result: ConversionResult, document: ExtractedDocument, output_text: Optional[str],
+                   options: ConversionOptions) -> None:
+    result.page_title = document.page_title
+    result.output_text = output_text
+    result.score = document.score
+    result.element = document.element
+    result.content = render_document(document, output_text, options)
+    if result.content is None:
+        result.error = "The engine failed" if output_text is None else "The conversion resulted in empty output"
+    else:
+        result.content_hash = hashlib.sha256(output_text.strip().encode('utf-8')).hexdigest()
+
+def _pandoc_batches(documents: List[ExtractedDocument], options: ConversionOptions) -> Iterator[List[ExtractedDocument]]:
+    """Group documents into pandoc batches capped by both document count and total HTML bytes."""
+    batch: List[ExtractedDocument] = []
+    batch_bytes = 0
+    for document in documents:
+        size = len(document.clean_html)
+        if batch and (len(batch) >= options.pandoc_batch_size or batch_bytes + size > options.pandoc_batch_bytes):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(document)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+def _extract_item(input_dir: str, item: InputItem, options: ConversionOptions,
+                  result: ConversionResult, state: JobState) -> Optional[ExtractedDocument]:
+    """Read, cache-check and extract one input item.
+
+    Returns the document still to be converted by the engine, or None once
+    result is final (served from the cache, or nothing to convert).
+    """
+    lap = time.perf_counter()
+    source = item.source if isinstance(item, InputRecord) else None
+    if isinstance(item, InputRecord) and item.error is not None:
+        result.error = f"Unreadable record: {item.error}"
+        return None
+    cached = None
+    with open_input(input_dir, item, options) as raw:
+        result.bytes_in = len(raw)
+        lap = _lap(result.timings, 'read', lap)
+        if options.cache_path:
+            result.cache_key = conversion_cache_key(raw, options)
+            cached = _get_cache_reader(options.cache_path).get(result.cache_key)
+            if cached is not None and options.dedup and cached[3] is None:
+                cached = None  # Cached by a run without --dedup; convert once more to store its signature
+            lap = _lap(result.timings, 'cache', lap)
+        if cached is None and options.prefilters(len(raw)):
+            raw = prefilter_html(raw)
+            lap = _lap(result.timings, 'prefilter', lap)
+    if cached is not None:
+        page_title, output_text, score, signature = cached
+        if _skip_near_duplicate(result, signature, options, state):
+            return None
+        logging.info(f"Using cached conversion for '{result.filename}'.")
+        result.cached = True
+        _finish_result(result, ExtractedDocument(result.filename, page_title, "", source=source, score=score),
+                       output_text, options)
+        return None
+
+    result.over_limit = over_limits(raw, options)
+    if result.over_limit is None:
+        try:
+            with document_deadline(options.document_timeout):
+                document = extract_document(result.filename, raw, options, result.timings, state)
+        except DocumentTimeout:
+            # The half-built tree is only reachable through its own reference cycles.
+            gc.collect()
+            result.over_limit = f"took over {options.document_timeout:g}s to parse, score and clean"
+    if result.over_limit is not None:
+        _convert_over_limit(raw, source, options, result)
+        return None
+
+    if document is None:
+        result.error = "No content to convert was found"
+        return None
+    if _skip_near_duplicate(result, document.signature, options, state):
+        release_tree(document.content_element)
+        return None
+    document.source = source
+    return document
+
+def _skip_near_duplicate(result: ConversionResult, signature: Optional[bytes], options: ConversionOptions,
+                         state: JobState) -> bool:
+    """With --dedup, check a page against the pages this process knows were kept, to save its engine call.
+
+    Only a hint: resolve_near_duplicate makes the final decision in input order.
+    """
+    if not options.dedup or signature is None:
+        return False
+    lap = time.perf_counter()
+    match = state.near_duplicates.match(signature)
+    _lap(result.timings, 'dedup', lap)
+    result.signature = signature
+    if match is None:
+        return False
+    result.duplicate_of = match[0]
+    result.error = f"Near-duplicate of '{match[0]}'"
+    return True
+
+def resolve_near_duplicate(result: ConversionResult, options: ConversionOptions, state: JobState,
+                           reconvert=None) -> ConversionResult:
+    """Decide whether a page is kept, in input order, against the pages kept before it.
+
+    A page is a near-duplicate only of pages that were converted successfully,
+    and is added to the index once it has been. If the page was skipped early
+    by a worker that saw a different set of kept pages and is not a
+    near-duplicate here, reconvert() converts it after all.
+    """
+    if not options.dedup or result.signature is None:
+        return result
+    index = state.near_duplicates
+    match = index.match(result.signature)
+    if match is not None:
+        result.content = None
+        result.duplicate_of = match[0]
+        result.error = f"Near-duplicate of '{match[0]}'"
+        logging.info(f"Skipping '{result.filename}': near-duplicate of '{match[0]}' (similarity {match[1]:.2f}).")
+        return result
+    if result.duplicate_of is not None and reconvert is not None:
+        logging.info(f"Converting '{result.filename}' after all: the page it resembled was not kept.")
+        signature = result.signature
+        result = reconvert()
+        result.signature = signature
+    if result.content is not None:
+        index.add(result.filename, result.signature)
+    return result
+
+def _convert_over_limit(raw: bytes, source: Optional[str], options: ConversionOptions,
+                        result: ConversionResult) -> None:
+    """Skip a page over the per-document limits, or convert it with the streaming text extractor."""
+    if options.oversize_action == 'skip':
+        logging.warning(f"Skipping '{result.filename}': it {result.over_limit}.")
+        result.error = f"Skipped: the page {result.over_limit}"
+        return
+    logging.warning(f"'{result.filename}' {result.over_limit}; extracting its text with the streaming fallback.")
+    lap = time.perf_counter()
+    page_title, output_text = extract_text_streaming(raw)
+    _lap(result.timings, 'degrade', lap)
+    _finish_result(result, ExtractedDocument(result.filename, page_title, "", source=source), output_text, options)
+
+def _record_crash(result: ConversionResult, error: Exception) -> None:
+    logging.critical(f"CRITICAL ERROR processing {result.filename}: {error}", exc_info=True)
+    result.content = None
+    result.error = f"{type(error).__name__}: {error}"
+
+def _extract_chunk(input_dir: str, filenames: List[InputItem], options: ConversionOptions,
+                   state: JobState) -> Tuple[List[ConversionResult], List[Tuple[ConversionResult, ExtractedDocument]]]:
+    """Run every stage before the engine for a chunk.
+
+    Returns a result per item and the documents still to be converted, each
+    paired with its result; the other results are already final.
+    """
+    results = [ConversionResult(input_item_name(item)) for item in filenames]
+    documents: List[Tuple[ConversionResult, ExtractedDocument]] = []
+    for result, item in zip(results, filenames):
+        try:
+            document = _extract_item(input_dir, item, options, result, state)
+        except Exception as e:
+            _record_crash(result, e)
+            continue
+        if document is not None:
+            documents.append((result, document))
+    return results, documents
+
+def _engine_batches(documents: List[Tuple[ConversionResult, ExtractedDocument]],
+                    options: ConversionOptions) -> Iterator[List[Tuple[ConversionResult, ExtractedDocument]]]:
+    """Group documents into the units of one engine call: pandoc batches when batching is enabled, else singles."""
+    if not (options.engine == 'pandoc' and options.pandoc_batch_size > 1):
+        for pair in documents:
+            yield [pair]
+        return
+    owners = {id(document): result for result, document in documents}
+    for batch in _pandoc_batches([document for _, document in documents], options):
+        yield [(owners[id(document)], document) for document in batch]
+
+def _render_in_process(batch: List[Tuple[ConversionResult, ExtractedDocument]],
+                       options: ConversionOptions) -> Optional[List[Optional[str]]]:
+    """Render a document the native engine kept as a tree, or return None if the batch needs an engine process."""
+    document = batch[0][1]
+    if document.content_element is None:
+        return None
+    output_text = render_native(document.content_element, options.output_format)
+    release_tree(document.content_element)
+    document.content_element = None
+    return [output_text]
+
+def _convert_batch(batch: List[Tuple[ConversionResult, ExtractedDocument]],
+                   options: ConversionOptions) -> List[Optional[str]]:
+    """Run the engine once for a batch from _engine_batches; return an output per document."""
+    outputs = _render_in_process(batch, options)
+    if outputs is not None:
+        return outputs
+    if options.engine == 'pandoc':
+        return convert_html_batch_pandoc([document.clean_html for _, document in batch], options.output_format)
+    return [convert_html_to_output(batch[0][1].clean_html, options.output_format, options.engine)]
+
+def _finish_batch(batch: List[Tuple[ConversionResult, ExtractedDocument]], outputs: List[Optional[str]],
+                  seconds: float, options: ConversionOptions) -> None:
+    # One engine call serves the whole batch; charge each document an equal share of it.
+    share = seconds / len(batch)
+    for (result, document), output_text in zip(batch, outputs):
+        result.timings['engine'] = result.timings.get('engine', 0.0) + share
+        try:
+            _finish_result(result, document, output_text, options)
+        except Exception as e:
+            _record_crash(result, e)
+
+def convert_files(input_dir: str, filenames: List[InputItem], options: ConversionOptions,
+                  state: Optional[JobState] = None) -> List[ConversionResult]:
+    """Convert a chunk of files or archive records, serving unchanged ones from the cache
+    and sharing pandoc processes between the rest when batching is enabled.
+
+    state carries what the job has learned from earlier chunks; without it the chunk is converted on its own.
+    """
+    state = state or JobState(options)
+    results, documents = _extract_chunk(input_dir, filenames, options, state)
+    for batch in _engine_batches(documents, options):
+        lap = time.perf_counter()
+        try:
+            outputs = _convert_batch(batch, options)
+        except Exception as e:
+            for result, _ in batch:
+                _record_crash(result, e)
+            continue
+        _finish_batch(batch, outputs, time.perf_counter() - lap, options)
+    return results
+
+def convert_file(input_dir: str, filename: str, options: ConversionOptions) -> Optional[str]:
+    """Run parse, score, clean and convert for one file and return the text to write, or None on failure."""
+    return convert_files(input_dir, [filename], options)[0].content
+
+class ConversionCache:
+    """SQLite store of converted documents, keyed by a hash of the raw file bytes and the job settings.
+
+    Worker processes only read from the cache; the parent process is the
+    single writer and also records hits, so eviction can drop the entries
+    that were used least recently once the cache grows past max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._pending_writes = 0
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversions ("
+            " key TEXT PRIMARY KEY, title TEXT NOT NULL, output TEXT NOT NULL,"
+            " size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS conversions_last_used ON conversions (last_used)")
+        # Caches created before content scores were indexed lack the column; their entries read back as None.
+        # Likewise for near-duplicate signatures, which are only stored by --dedup runs.
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(conversions)")}
+        if "score" not in columns:
+            self._db.execute("ALTER TABLE conversions ADD COLUMN score INTEGER")
+        if "signature" not in columns:
+            self._db.execute("ALTER TABLE conversions ADD COLUMN signature BLOB")
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[Tuple[str, str, Optional[int], Optional[bytes]]]:
+        row = self._db.execute("SELECT title, output, score, signature FROM conversions WHERE key = ?",
+                               (key,)).fetchone()
+        return (row[0], row[1], row[2], row[3]) if row else None
+
+    def put(self, key: str, page_title: str, output_text: str, score: Optional[int] = None,
+            signature: Optional[bytes] = None) -> None:
+        size = len(output_text.encode('utf-8')) + len(page_title.encode('utf-8'))
+        self._db.execute(
+            "INSERT OR REPLACE INTO conversions (key, title, output, size, last_used, score, signature)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, page_title, output_text, size, time.time(), score, signature)
+        )
+        self._commit_periodically()
+
+    def touch(self, key: str) -> None:
+        self._db.execute("UPDATE conversions SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._commit_periodically()
+
+    def _commit_periodically(self) -> None:
+        self._pending_writes += 1
+        if self._pending_writes >= 100:
+            self._db.commit()
+            self._pending_writes = 0
+
+    def evict(self) -> int:
+        """Delete least recently used entries until the cache fits in max_bytes; return how many were removed."""
+        if self.max_bytes <= 0:
+            return 0
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM conversions").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM conversions ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+            removed += 1
+        self._db.executemany("DELETE FROM conversions WHERE key = ?", doomed)
+        self._db.commit()
+        return removed
+
+    def close(self) -> None:
+        self._db.commit()
+        self._db.close()
+
+def conversion_cache_key(raw: bytes, options: ConversionOptions) -> str:
+    """Hash the raw page bytes together with everything that changes the converted text."""
+    digest = hashlib.sha256(raw)
+    digest.update(f"\0{options.engine}\0{options.output_format}\0{options.parser}".encode('utf-8'))
+    digest.update(f"\0{VERSION}\0{CONVERTER_REVISION}".encode('utf-8'))
+    if options.prefilters(len(raw)):
+        digest.update(b"\0prefilter")
+    if options.learn_boilerplate:
+        digest.update(f"\0boilerplate{options.boilerplate_min_pages}".encode('utf-8'))
+    return digest.hexdigest()
+
+_cache_readers: Dict[str, ConversionCache] = {}
+
+def _get_cache_reader(path: str) -> ConversionCache:
+    """Return this process's read connection to the cache at path."""
+    if path not in _cache_readers:
+        _cache_readers[path] = ConversionCache(path)
+    return _cache_readers[path]
+
+class _LogRecordBuffer(logging.Handler):
+    """Collect log records inside a worker process so the parent can replay them in file order."""
+
+    def __init__(self) -> None:
+        super().__init__(level=logging.INFO)
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Flatten the record so it survives pickling back to the parent process.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+    def drain(self) -> List[logging.LogRecord]:
+        records, self.records = self.records, []
+        return records
+
+_worker_log_buffer: Optional[_LogRecordBuffer] = None
+_worker_state: Optional[JobState] = None
+
+def _init_worker(options: ConversionOptions) -> None:
+    """Process pool initializer: leave Ctrl+C to the parent, buffer all log output, start engine workers
+    and give the worker its own JobState for the job."""
+    global _worker_log_buffer, _worker_state
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_state = JobState(options)
+    _worker_log_buffer = _LogRecordBuffer()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_worker_log_buffer)
+    root.setLevel(logging.INFO)
+    if options.persistent_engine:
+        start_engine_pool(max_docs=options.engine_max_docs)
+
+def _convert_files_in_worker(input_dir: str, filenames: List[InputItem], options: ConversionOptions) -> Tuple[List[ConversionResult], List[logging.LogRecord]]:
+    results = convert_files(input_dir, filenames, options, _worker_state)
+    if options.dedup:
+        # The parent decides what is kept; remembering this worker's conversions only lets it skip engine calls.
+        for result in results:
+            if result.content is not None and result.signature is not None:
+                _worker_state.near_duplicates.add(result.filename, result.signature)
+    return results, _worker_log_buffer.drain() if _worker_log_buffer else []
+
+def _chunked(items: Iterable[InputItem], size: int) -> Iterator[List[InputItem]]:
+    chunk: List[InputItem] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_converted_files(input_dir: str, filenames: Iterable[InputItem], options: ConversionOptions,
+                         workers: int = 1) -> Iterator[ConversionResult]:
+    """Yield one ConversionResult per file in input order, fanning the work out to a process pool if workers > 1."""
+    # Files are handed out in chunks so that batched engines can share one process per chunk.
+    chunk_size = max(options.pandoc_batch_size, 1) if options.engine == 'pandoc' else 1
+    chunks = _chunked(filenames, chunk_size)
+    state = JobState(options)
+
+    if workers <= 1 and options.engine_concurrency > 1:
+        for result in _iter_converted_files_async(input_dir, chunks, options, state):
+            yield resolve_near_duplicate(result, options, state)
+        return
+
+    if workers <= 1:
+        if options.persistent_engine:
+            start_engine_pool(max_docs=options.engine_max_docs)
+        for chunk in chunks:
+            for result in convert_files(input_dir, chunk, options, state):
+                yield resolve_near_duplicate(result, options, state)
+        return
+
+    # Pages a worker skipped as near-duplicates are converted here if the parent keeps them.
+    reconvert_options = replace(options, dedup=False)
+    reconvert_state = JobState(reconvert_options)
+
+    def collect_oldest() -> List[ConversionResult]:
+        chunk, future = pending.popleft()
+        results, records = future.result()
+        root = logging.getLogger()
+        for record in records:
+            if root.isEnabledFor(record.levelno):
+                root.handle(record)
+        return [resolve_near_duplicate(result, options, state,
+                                       lambda item=item: convert_files(input_dir, [item], reconvert_options,
+                                                                       reconvert_state)[0])
+                for item, result in zip(chunk, results)]
+
+    # Keep a bounded window of in-flight chunks so results can be yielded strictly
+    # in input order without queueing the whole directory up front.
+    max_in_flight = workers * 4
+    pending: Deque[Tuple[List[InputItem], concurrent.futures.Future]] = collections.deque()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,))
+    try:
+        for chunk in chunks:
+            pending.append((chunk, executor.submit(_convert_files_in_worker, input_dir, chunk, options)))
+            if len(pending) >= max_in_flight:
+                yield from collect_oldest()
+        while pending:
+            yield from collect_oldest()
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+# --- Asyncio pipeline ---
+
+async def _communicate_async(command: Union[List[str], str], input_bytes: bytes) -> Tuple[int, bytes, bytes]:
+    """Run an engine command without blocking the event loop; a string command runs through the shell.
+
+    Like _communicate, raises TimeoutExpired once the engine runs past ENGINE_TIMEOUT seconds.
+    """
+    if isinstance(command, str):
+        process = await asyncio.create_subprocess_shell(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    else:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(input=input_bytes), ENGINE_TIMEOUT)
+    except asyncio.TimeoutError:
+        with contextlib.suppress(ProcessLookupError):
+            process.kill()
+        await process.wait()
+        raise subprocess.TimeoutExpired(command, ENGINE_TIMEOUT) from None
+    except BaseException:
+        # Cancelled (e.g. Ctrl+C): do not leave the engine running.
+        if process.returncode is None:
+            with contextlib.suppress(ProcessLookupError):
+                process.kill()
+        raise
+    return process.returncode, stdout, stderr
+
+async def _run_engine_async(call: EngineCall):
+    """Asyncio counterpart of _run_engine: awaits each engine process instead of blocking on it."""
+    try:
+        request = next(call)
+        while True:
+            try:
+                reply = await _communicate_async(*request)
+            except asyncio.CancelledError:
+                raise  # An Exception before Python 3.8; never a failed engine run
+            except Exception as e:
+                request = call.throw(e)
+            else:
+                request = call.send(reply)
+    except StopIteration as done:
+        return done.value
+
+async def convert_html_to_output_async(html_string: str, output_format: str, engine: str) -> Optional[str]:
+    """Asyncio counterpart of convert_html_to_output."""
+    if engine == 'pandoc':
+        return await _run_engine_async(_pandoc_call(html_string, output_format))
+    elif engine == 'html-to-text' and _engine_pool is None:
+        return await _run_engine_async(_html_to_text_call(html_string, output_format))
+    elif engine == 'html-to-text' and html_string:
+        # Resident workers speak a blocking protocol; each call borrows an idle worker on a thread.
+        return await asyncio.get_running_loop().run_in_executor(None, _engine_pool.convert, html_string, output_format)
+    return convert_html_to_output(html_string, output_format, engine)
+
+async def _convert_batch_async(batch: List[Tuple[ConversionResult, ExtractedDocument]],
+                               options: ConversionOptions) -> List[Optional[str]]:
+    """Asyncio counterpart of _convert_batch."""
+    outputs = _render_in_process(batch, options)
+    if outputs is not None:
+        return outputs
+    if options.engine == 'pandoc':
+        return await _run_engine_async(_pandoc_bisect_call([document.clean_html for _, document in batch],
+                                                           options.output_format))
+    return [await convert_html_to_output_async(batch[0][1].clean_html, options.output_format, options.engine)]
+
+async def _convert_files_async(input_dir: str, filenames: List[InputItem], options: ConversionOptions,
+                               engine_slots: asyncio.Semaphore, state: JobState) -> List[ConversionResult]:
+    """Like convert_files, but each engine call waits for one of engine_slots and yields to other chunks."""
+    results, documents = _extract_chunk(input_dir, filenames, options, state)
+    for batch in _engine_batches(documents, options):
+        async with engine_slots:
+            lap = time.perf_counter()
+            try:
+                outputs = await _convert_batch_async(batch, options)
+            except Exception as e:
+                for result, _ in batch:
+                    _record_crash(result, e)
+                continue
+            seconds = time.perf_counter() - lap
+        _finish_batch(batch, outputs, seconds, options)
+    return results
+
+def _iter_converted_files_async(input_dir: str, chunks: Iterator[List[InputItem]],
+                                options: ConversionOptions, state: JobState) -> Iterator[ConversionResult]:
+    """Yield ConversionResults in input order while up to options.engine_concurrency engine calls run at once.
+
+    Reading and parsing the next chunks overlaps with the engine processes of
+    earlier ones. The event loop only runs while this generator waits for the
+    oldest chunk, so the caller writes output exactly as in the serial pipeline.
+    """
+    loop = asyncio.ProactorEventLoop() if sys.platform == 'win32' else asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    engine_slots = asyncio.Semaphore(options.engine_concurrency)
+    if options.persistent_engine:
+        start_engine_pool(size=options.engine_concurrency, max_docs=options.engine_max_docs)
+
+    # Chunks extracted ahead of the writer are bounded, so memory stays flat however long the input is.
+    max_in_flight = options.engine_concurrency * 2
+    pending: Deque[asyncio.Task] = collections.deque()
+    try:
+        for chunk in chunks:
+            pending.append(loop.create_task(_convert_files_async(input_dir, chunk, options, engine_slots, state)))
+            if len(pending) >= max_in_flight:
+                results = loop.run_until_complete(pending[0])
+                pending.popleft()
+                yield from results
+        while pending:
+            results = loop.run_until_complete(pending[0])
+            pending.popleft()
+            yield from results
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        asyncio.set_event_loop(None)
+        loop.close()
+
+# --- Library API ---
+
+def _as_input_item(value: Union[str, bytes, InputRecord], position: int) -> InputItem:
+    if isinstance(value, (bytes, bytearray)):
+        name = f"document-{position}.html"
+        return InputRecord(name, name, bytes(value))
+    return value
+
+def convert_document(html: Union[str, bytes], name: str = "document.html",
+                     options: Optional[ConversionOptions] = None) -> ConversionResult:
+    """Convert one in-memory page without touching the disk.
+
+    Runs the same extraction, scoring, cleaning and engine conversion as
+    process_html_files. Failures are reported in the result's error field
+    instead of being raised.
+
+    Usage:
+        result = convert_document(html, 'page.html', ConversionOptions(engine='native'))
+        if result.ok:
+            print(result.title, result.score, result.text)
+    """
+    options = options or ConversionOptions()
+    if options.persistent_engine:
+        start_engine_pool(max_docs=options.engine_max_docs)
+    raw = html.encode('utf-8') if isinstance(html, str) else bytes(html)
+    state = JobState(options)
+    return resolve_near_duplicate(convert_files("", [InputRecord(name, name, raw)], options, state)[0], options, state)
+
+def iter_convert(inputs: Iterable[Union[str, bytes, InputRecord]], options: Optional[ConversionOptions] = None,
+                 workers: int = 1, input_dir: str = "") -> Iterator[ConversionResult]:
+    """Lazily convert pages and yield one ConversionResult per input, in input order, writing nothing.
+
+    Inputs are file paths (relative to input_dir), raw HTML bytes (named
+    document-<position>.html) or InputRecords. Inputs are consumed as results
+    are requested, so a long or endless stream is converted with bounded memory.
+    With workers > 1 pages are converted in a process pool, and with
+    options.engine_concurrency > 1 by the asyncio pipeline.
+
+    Usage:
+        for result in iter_convert(paths, ConversionOptions(engine='native'), workers=4):
+            if result.ok:
+                loader.add(result.text, metadata={"title": result.title, "source": result.filename})
+    """
+    options = options or ConversionOptions()
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    items = (_as_input_item(value, position) for position, value in enumerate(inputs))
+    try:
+        yield from iter_converted_files(input_dir, items, options, workers)
+    finally:
+        if options.persistent_engine:
+            stop_engine_pool()
+
+class OutputWriter:
+    """Append converted documents to numbered output files, rolling over at MAX_FILE_SIZE_BYTES."""
+
+    def __init__(self, output_dir: str, filename_template: str, part: int = 1, offset: int = 0) -> None:
+        self.output_dir = output_dir
+        self.filename_template = filename_template
+        self.part = part
+        self.last_offset = 0  # Where the most recently written document starts in the current part
+        self.filepath = os.path.join(output_dir, filename_template.format(self.part))
+        if offset > 0:
+            # Resuming: drop anything written after the last checkpoint, then append.
+            with open(self.filepath, 'r+b') as f:
+                f.truncate(offset)
+            logging.info(f"Resuming output file at byte {offset}: {self.filepath}")
+            self._file = open(self.filepath, 'ab')
+        else:
+            logging.info(f"Creating new output file: {self.filepath}")
+            self._file = open(self.filepath, 'wb')
+        # Bytes in the current part, kept as documents are written so the file never has to be asked.
+        self.size = offset
+
+    def write(self, content: str) -> int:
+        """Append content, rolling over to a new part first if it would not fit; return its size in bytes."""
+        data = content.encode('utf-8')
+        if os.linesep != '\n':
+            data = data.replace(b'\n', os.linesep.encode('ascii'))  # The newlines text-mode output used to write
+        if self.size + len(data) > MAX_FILE_SIZE_BYTES and self.size > 0:
+            self._file.close()
+            self.part += 1
+            self.filepath = os.path.join(self.output_dir, self.filename_template.format(self.part))
+            logging.info(f"Max file size reached. Creating new output file: {self.filepath}")
+            self._file = open(self.filepath, 'wb')
+            self.size = 0
+        self.last_offset = self.size
+        self._file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        """Flush buffered output and return the byte offset in the current part."""
+        self._file.flush()
+        return self.size
+
+    def close(self) -> None:
+        self._file.close()
+
+def job_settings(output_format: str, engine: str, parser: str, chunk_tokens: int = 0,
+                 tokenizer: str = 'estimate') -> Dict:
+    """The settings recorded in checkpoints, shard manifests and metrics; resumed and merged jobs must match them."""
+    settings = {"format": output_format, "engine": engine, "parser": parser}
+    if chunk_tokens:
+        settings.update(chunk_tokens=chunk_tokens, tokenizer=tokenizer)
+    return settings
+
+def output_part_template(job_name: str, settings: Dict) -> str:
+    """File name template of a job's numbered output parts."""
+    if settings.get("chunk_tokens"):
+        return f"{job_name}_chunks_{{}}.jsonl"
+    return f"{job_name}_output_{{}}.{settings['format']}"
+
+def load_checkpoint(checkpoint_path: str, settings: Dict) -> Optional[Dict]:
+    """Return a saved checkpoint if it belongs to a job with the same settings."""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("settings") != settings:
+        logging.warning(f"Ignoring checkpoint {checkpoint_path}: it was written with different settings {checkpoint.get('settings')}.")
+        return None
+    return checkpoint
+
+def save_checkpoint(checkpoint_path: str, checkpoint: Dict) -> None:
+    """Write the checkpoint atomically so a kill mid-write never leaves a torn file."""
+    temp_path = checkpoint_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, checkpoint_path)
+
+class OutputIndexWriter:
+    """Append one JSON line per written document to <job>_index.jsonl.
+
+    Each line records the document's input position and name, the output part
+    it went to, its byte offset and length there, and its title, content score
+    and SHA-256, so OutputIndex can read single documents without scanning the parts.
+    """
+
+    def __init__(self, output_dir: str, job_name: str, offset: int = 0) -> None:
+        self.path = os.path.join(output_dir, f"{job_name}_index.jsonl")
+        if offset > 0:
+            # Resuming: drop the entries written after the last checkpoint, then append.
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+            self._file = open(self.path, 'ab')
+        else:
+            self._file = open(self.path, 'wb')
+
+    def add(self, position: int, result: ConversionResult, part_path: str, offset: int, length: int) -> None:
+        self.add_entry({
+            "position": position,
+            "name": result.filename,
+            "part": os.path.basename(part_path),
+            "offset": offset,
+            "length": length,
+            "title": result.page_title,
+            "score": result.score,
+            "sha256": result.content_hash,
+        })
+
+    def add_entry(self, entry: Dict) -> None:
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+
+    def tell(self) -> int:
+        self._file.flush()
+        return self._file.tell()
+
+    def close(self) -> None:
+        self._file.close()
+
+class OutputIndex:
+    """Look up documents in a job's output through its <job>_index.jsonl, reading only the bytes needed.
+
+    Usage:
+        index = OutputIndex('out/html_index.jsonl')
+        entry = index.find('docs/page.html')
+        text = index.read(entry)
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self._by_name: Optional[Dict[str, Dict]] = None
+
+    def __iter__(self) -> Iterator[Dict]:
+        """Yield every index entry, in the order the documents were written."""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def find(self, name: str) -> Optional[Dict]:
+        """Return the entry for an input file or archive record name, or None if it was not converted."""
+        if self._by_name is None:
+            self._by_name = {entry["name"]: entry for entry in self}
+        return self._by_name.get(name)
+
+    def read(self, entry: Dict) -> str:
+        """Return the document text (frontmatter included) exactly as it was written to the output part."""
+        with open(os.path.join(self.directory, entry["part"]), 'rb') as f:
+            f.seek(entry["offset"])
+            return self._decode(f.read(entry["length"]))
+
+    def iter_documents(self) -> Iterator[Tuple[Dict, str]]:
+        """Yield (entry, text) for every document, keeping one output part open at a time."""
+        handle, handle_part = None, None
+        try:
+            for entry in self:
+                if entry["part"] != handle_part:
+                    if handle:
+                        handle.close()
+                    handle_part = entry["part"]
+                    handle = open(os.path.join(self.directory, handle_part), 'rb')
+                handle.seek(entry["offset"])
+                yield entry, self._decode(handle.read(entry["length"]))
+        finally:
+            if handle:
+                handle.close()
+
+    @staticmethod
+    def _decode(data: bytes) -> str:
+        text = data.decode('utf-8')
+        if os.linesep != '\n':
+            text = text.replace(os.linesep, '\n')  # Undo the newline translation of text-mode output
+        return text
+
+def format_job_summary(engine: str, total_files: int, job_stats: Dict[str, int], output_format: str,
+                       cache_used: bool, log_path: str, metrics_path: str, peak_rss: Optional[int] = None,
+                       peak_child_rss: Optional[int] = None) -> str:
+    summary = (
+        f"\n{'='*25} JOB SUMMARY {'='*25}\n"
+        f"  - Engine used:                {engine}\n"
+        f"  - Total HTML files scanned:   {total_files}\n"
+        f"  - Successful extractions:     {job_stats['successful']}\n"
+        f"  - Failed extractions:         {job_stats['failed']}\n"
+    )
+    if job_stats.get('degraded') or job_stats.get('skipped'):
+        summary += (
+            f"  - Over per-document limits:   {job_stats.get('degraded', 0)} degraded, "
+            f"{job_stats.get('skipped', 0)} skipped\n"
+        )
+    if job_stats.get('duplicates'):
+        summary += f"  - Near-duplicates skipped:    {job_stats['duplicates']}\n"
+    if job_stats.get('chunks'):
+        summary += f"  - Token-budget chunks:        {job_stats['chunks']}\n"
+    if cache_used:
+        summary += f"  - Served from cache:          {job_stats['cached']}\n"
+    if peak_rss is not None:
+        summary += f"  - Peak memory (RSS):          {peak_rss / (1024 * 1024):.1f} MB"
+        if peak_child_rss:
+            summary += f" (largest child process: {peak_child_rss / (1024 * 1024):.1f} MB)"
+        summary += "\n"
+    summary += (
+        f"  - Total output files created: {job_stats['output_files']} (.{output_format})\n"
+        f"  - Detailed log saved to: '{log_path}'\n"
+        f"  - Stage metrics saved to: '{metrics_path}'\n"
+        f"{'='*65}"
+    )
+    return summary
+
+def merge_shards(manifest_paths: List[str], output_dir: str) -> None:
+    """Combine the outputs of all shards of a job into the files and index a single-node run would have written."""
+    manifests = []
+    for path in manifest_paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifests.append(json.load(f))
+    first = manifests[0]
+    shard_count = first["shard"]["count"]
+    problems = []
+    for path, manifest in zip(manifest_paths, manifests):
+        if not manifest.get("complete"):
+            problems.append(f"{path} is from a shard that has not finished")
+        for key in ("input_folder", "settings", "version"):
+            if manifest.get(key) != first.get(key):
+                problems.append(f"{path} has {key} {manifest.get(key)!r}, expected {first.get(key)!r}")
+        if manifest["shard"]["count"] != shard_count:
+            problems.append(f"{path} is one of {manifest['shard']['count']} shards, expected {shard_count}")
+    indexes = sorted(manifest["shard"]["index"] for manifest in manifests)
+    if indexes != list(range(shard_count)):
+        problems.append(f"expected one manifest for each of shards 0..{shard_count - 1}, got shards {indexes}")
+    if problems:
+        for problem in problems:
+            print(f"Error: {problem}.", file=sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    input_folder_name = first["input_folder"]
+    output_format = first["settings"]["format"]
+    chunked = bool(first["settings"].get("chunk_tokens"))
+    setup_logging(output_dir, input_folder_name)
+    logging.info(f"Merging {shard_count} shards of '{input_folder_name}' into '{output_dir}'.")
+
+    job_stats: Dict[str, int] = {"successful": 0, "failed": 0, "output_files": 1, "cached": 0,
+                                 "degraded": 0, "skipped": 0, "chunks": 0, "duplicates": 0}
+    for manifest in manifests:
+        for key in ("successful", "failed", "cached", "degraded", "skipped", "chunks", "duplicates"):
+            job_stats[key] += manifest["job_stats"].get(key, 0)
+
+    writer = OutputWriter(output_dir, output_part_template(input_folder_name, first["settings"]))
+    index = OutputIndexWriter(output_dir, input_folder_name)
+    bytes_out = 0
+    try:
+        streams = [OutputIndex(os.path.join(os.path.dirname(os.path.abspath(path)), manifest["index"])).iter_documents()
+                   for path, manifest in zip(manifest_paths, manifests)]
+        for entry, content in heapq.merge(*streams, key=lambda document: document[0]["position"]):
+            bytes_out += writer.write(content)
+            index.add_entry(dict(entry, part=os.path.basename(writer.filepath), offset=writer.last_offset))
+    finally:
+        writer.close()
+        index.close()
+    job_stats["output_files"] = writer.part
+
+    # Stage percentiles cannot be combined from per-shard summaries, so they are kept per shard.
+    metrics_path = os.path.join(output_dir, f"metrics_{input_folder_name}.json")
+    shard_metrics = []
+    for path, manifest in zip(manifest_paths, manifests):
+        shard_metrics_path = os.path.join(os.path.dirname(os.path.abspath(path)), manifest["metrics"])
+        if os.path.exists(shard_metrics_path):
+            with open(shard_metrics_path, 'r', encoding='utf-8') as f:
+                shard_metrics.append(dict(json.load(f), shard=manifest["shard"]["index"]))
+    with open(metrics_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "settings": first["settings"],
+            "merged_shards": shard_count,
+            "files": sum(manifest["total_files"] for manifest in manifests),
+            "bytes_in": sum(metrics.get("bytes_in", 0) for metrics in shard_metrics),
+            "bytes_out": bytes_out,
+            "shards": shard_metrics,
+        }, f, indent=2)
+
+    summary = format_job_summary(
+        first["settings"]["engine"], sum(manifest["total_files"] for manifest in manifests), job_stats,
+        'jsonl' if chunked else output_format, any(manifest["cache_used"] for manifest in manifests),
+        os.path.join(output_dir, f"run_{input_folder_name}.log"), metrics_path,
+        max((metrics.get("peak_rss_bytes") or 0 for metrics in shard_metrics), default=None),
+        max((metrics.get("peak_child_rss_bytes") or 0 for metrics in shard_metrics), default=None))
+    print(summary)
+    logging.info("Merge finished.")
+    logging.info(summary)
+    if job_stats["failed"] > 0:
+        sys.exit(1)
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process, or None where it cannot be measured."""
+    # VmHWM starts from zero at exec, unlike ru_maxrss, which inherits the parent's peak across fork.
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def peak_child_rss_bytes() -> Optional[int]:
+    """Peak resident set size of the largest finished child process, such as a --workers process or an engine.
+
+    None where it cannot be measured, or if no child process has exited yet.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if not peak:
+        return None
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    rank = max(int(-(-percent * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+class JobMetrics:
+    """Per-file stage timings and byte counts for one job, summarised as metrics_<folder>.json."""
+
+    def __init__(self, slowest: int = 10) -> None:
+        self.slowest = slowest
+        self.started = time.perf_counter()
+        self.stage_seconds: Dict[str, List[float]] = {stage: [] for stage in PIPELINE_STAGES}
+        self.file_seconds: List[float] = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        # Min-heap of (seconds, sequence, record) holding the slowest files seen so far.
+        self._slowest_heap: List[Tuple[float, int, Dict]] = []
+
+    def add(self, result: ConversionResult, bytes_out: int) -> None:
+        for stage, seconds in result.timings.items():
+            self.stage_seconds[stage].append(seconds)
+        total = sum(result.timings.values())
+        self.file_seconds.append(total)
+        self.bytes_in += result.bytes_in
+        self.bytes_out += bytes_out
+
+        if self.slowest > 0 and (len(self._slowest_heap) < self.slowest or total > self._slowest_heap[0][0]):
+            record = {
+                "file": result.filename,
+                "seconds": round(total, 6),
+                "status": ("cached" if result.cached else "degraded" if result.over_limit and result.content
+                           else "skipped" if result.over_limit else "duplicate" if result.duplicate_of
+                           else "ok" if result.content else "failed"),
+                "bytes_in": result.bytes_in,
+                "bytes_out": bytes_out,
+                "stages": {stage: round(seconds, 6) for stage, seconds in result.timings.items()},
+            }
+            entry = (total, len(self.file_seconds), record)
+            if len(self._slowest_heap) < self.slowest:
+                heapq.heappush(self._slowest_heap, entry)
+            else:
+                heapq.heapreplace(self._slowest_heap, entry)
+
+    @staticmethod
+    def _distribution(values: List[float]) -> Dict[str, float]:
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "total_s": round(sum(values), 6),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            "p50_ms": round(_percentile(values, 50) * 1000, 3),
+            "p95_ms": round(_percentile(values, 95) * 1000, 3),
+            "p99_ms": round(_percentile(values, 99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+        }
+
+    def summary(self) -> Dict:
+        wall_seconds = time.perf_counter() - self.started
+        return {
+            "files": len(self.file_seconds),
+            "wall_s": round(wall_seconds, 3),
+            "files_per_s": round(len(self.file_seconds) / wall_seconds, 3) if wall_seconds > 0 else None,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "peak_rss_bytes": peak_rss_bytes(),  # This process only, not --workers processes or engines
+            "peak_child_rss_bytes": peak_child_rss_bytes(),  # Largest child process that has exited
+            # With --workers, stage times are per-worker CPU-side wall time and add up to more than wall_s.
+            "stages": {stage: self._distribution(values) for stage, values in self.stage_seconds.items() if values},
+            "per_file": self._distribution(self.file_seconds) if self.file_seconds else None,
+            "slowest": [record for _, _, record in sorted(self._slowest_heap, reverse=True)],
+        }
+
+    def write(self, path: str, extra: Optional[Dict] = None) -> None:
+        metrics = dict(extra or {})
+        metrics.update(self.summary())
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, indent=2)
+
+def run_profiled(profiler: str, output_path: str, func, *args) -> None:
+    """Run func(*args) under cProfile or pyinstrument and save the profile to output_path,
+    even if func exits early. Only this process is profiled, not --workers processes."""
+    if profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logging.critical("FATAL ERROR: '--profile pyinstrument' requires the 'pyinstrument' package.")
+            logging.critical("Install it with: pip install pyinstrument")
+            sys.exit(1)
+        instrument = Profiler()
+        instrument.start()
+        try:
+            func(*args)
+        finally:
+            instrument.stop()
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(instrument.output_html())
+            print(f"Profile saved to: '{output_path}'")
+    else:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            func(*args)
+        finally:
+            profile.disable()
+            profile.dump_stats(output_path)
+            print(f"Profile saved to: '{output_path}' (view with: python -m pstats {output_path})")
+
+def process_html_files(input_dir: str, output_dir: str, output_format: str, engine: str, workers: int = 1,
+                       persistent_engine: bool = False, engine_max_docs: int = 500,
+                       pandoc_batch_size: int = 1, pandoc_batch_bytes: int = 1024 * 1024,
+                       parser: str = 'html5lib', cache_path: Optional[str] = None,
+                       cache_max_bytes: int = 0, resume: bool = False, metrics_slowest: int = 10,
+                       recursive: bool = False, include: Optional[List[str]] = None,
+                       exclude: Optional[List[str]] = None, ordered: bool = True, archives: bool = False,
+                       prefilter: bool = False, prefilter_min_bytes: int = PREFILTER_MIN_BYTES,
+                       shard: Optional[Tuple[int, int]] = None, engine_concurrency: int = 1,
+                       learn_boilerplate: bool = False, boilerplate_min_pages: int = BOILERPLATE_MIN_PAGES,
+                       boilerplate_cache_size: int = BOILERPLATE_CACHE_SIZE, max_input_bytes: int = 0,
+                       max_nodes: int = 0, document_timeout: float = 0.0,
+                       oversize_action: str = 'degrade', chunk_tokens: int = 0,
+                       tokenizer: str = 'estimate', dedup: bool = False,
+                       dedup_threshold: float = DEDUP_THRESHOLD) -> None:
+    """Orchestrate the HTML conversion process.
+
+    With shard=(i, N) only the files whose path hashes to shard i are converted,
+    and a manifest is written so merge_shards can combine all N shards.
+    """
+    if not os.path.isdir(input_dir):
+        print(f"Error: Input directory '{input_dir}' not found.", file=sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    
+    input_folder_name = os.path.basename(os.path.normpath(input_dir))
+    # Each shard names its files after the job and shard, so shards can share an output directory.
+    job_name = f"{input_folder_name}_shard{shard[0]}of{shard[1]}" if shard else input_folder_name
+    checkpoint_path = os.path.join(output_dir, f"{job_name}_checkpoint.json")
+    metrics_path = os.path.join(output_dir, f"metrics_{job_name}.json")
+    log_path = os.path.join(output_dir, f"run_{job_name}.log")
+    resume = resume and os.path.exists(checkpoint_path)
+    setup_logging(output_dir, job_name, append=resume)
+    
+    paths = iter_input_files(
+        input_dir, recursive, (include or DEFAULT_INCLUDE_GLOBS) + (ARCHIVE_GLOBS if archives else []), exclude, ordered)
+    numbered_paths = select_shard(paths, *shard) if shard else enumerate(paths)
+    # Position in the full input order of each item handed to the pipeline, recorded in the output index.
+    positions: Deque[int] = collections.deque()
+
+    def positioned_items() -> Iterator[InputItem]:
+        for position, path in numbered_paths:
+            # Archives hold an unknown number of records, so they are expanded as they are reached.
+            for item in (iter_input_items(input_dir, [path], include, exclude) if archives else [path]):
+                positions.append(position)
+                yield item
+
+    input_files: Iterator[InputItem] = positioned_items()
+    total_files: Optional[int] = None
+    if ordered and not recursive and not archives:
+        # A sorted directory is listed in full anyway; counting it gives the progress bar an ETA.
+        all_files = list(input_files)
+        total_files = len(all_files)
+        input_files = iter(all_files)
+    first_file = next(input_files, None)
+    if first_file is None:
+        logging.warning(f"No HTML files found in '{input_dir}'.")
+        return
+    input_files = itertools.chain([first_file], input_files)
+
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    options = ConversionOptions(output_format=output_format, engine=engine,
+                                persistent_engine=persistent_engine, engine_max_docs=engine_max_docs,
+                                pandoc_batch_size=pandoc_batch_size, pandoc_batch_bytes=pandoc_batch_bytes,
+                                parser=parser, cache_path=cache_path,
+                                prefilter=prefilter, prefilter_min_bytes=prefilter_min_bytes,
+                                engine_concurrency=engine_concurrency, learn_boilerplate=learn_boilerplate,
+                                boilerplate_min_pages=boilerplate_min_pages,
+                                boilerplate_cache_size=boilerplate_cache_size, max_input_bytes=max_input_bytes,
+                                max_nodes=max_nodes, document_timeout=document_timeout,
+                                oversize_action=oversize_action, chunk_tokens=chunk_tokens, tokenizer=tokenizer,
+                                dedup=dedup, dedup_threshold=dedup_threshold)
+
+    job_stats: Dict[str, int] = {"successful": 0, "failed": 0, "output_files": 1, "cached": 0,
+                                 "degraded": 0, "skipped": 0, "chunks": 0, "duplicates": 0}
+    settings = job_settings(output_format, engine, parser, chunk_tokens, tokenizer)
+    files_done = 0
+    last_file: Optional[str] = None  # Name of the last converted file or archive record
+    output_offset = 0
+    index_offset = 0
+    # --dedup and --learn-boilerplate learn from every page converted, and the pages before a
+    # checkpoint are not read again, so a resumed job would not match an uninterrupted one.
+    resumable = not dedup and not learn_boilerplate
+    checkpoint = load_checkpoint(checkpoint_path, settings) if resume else None
+    if checkpoint and not resumable:
+        logging.critical("Cannot resume: jobs with --dedup or --learn-boilerplate must be rerun from the start.")
+        sys.exit(1)
+    if checkpoint:
+        # Skip the files already converted, checking that the input still lists them in the same order.
+        for item in itertools.islice(input_files, checkpoint["files_done"]):
+            last_file = input_item_name(item)
+            files_done += 1
+            positions.popleft()
+        if files_done < checkpoint["files_done"] or last_file != checkpoint["last_file"]:
+            logging.critical(f"Cannot resume: the input files no longer match checkpoint {checkpoint_path}.")
+            sys.exit(1)
+        job_stats.update(checkpoint["job_stats"])
+        output_offset = checkpoint["output_offset"]
+        index_offset = checkpoint.get("index_offset", 0)
+        logging.info(f"Resuming job from checkpoint after {files_done} files.")
+
+    found = f"Found {total_files} HTML files" if total_files is not None else "Streaming HTML files"
+    logging.info(f"Starting job. {found} in '{input_dir}'. Output format: {output_format.upper()}. Engine: {engine}. Parser: {parser}. Workers: {workers}. Engine concurrency: {engine_concurrency}")
+    
+    output_filename_template = output_part_template(job_name, settings)
+    writer = None
+    index = None
+    cache = ConversionCache(cache_path, cache_max_bytes) if cache_path else None
+    metrics = JobMetrics(metrics_slowest)
+    results = iter_convert(input_files, options, workers, input_dir)
+    completed = False
+
+    def write_checkpoint() -> None:
+        save_checkpoint(checkpoint_path, {
+            "settings": settings,
+            "files_done": files_done,
+            "last_file": last_file,
+            "output_offset": writer.tell(),
+            "index_offset": index.tell(),
+            "job_stats": job_stats,
+        })
+    
+    try:
+        writer = OutputWriter(output_dir, output_filename_template, job_stats["output_files"], output_offset)
+        index = OutputIndexWriter(output_dir, job_name, index_offset)
+        pbar = tqdm(results, total=total_files, initial=files_done, desc="Processing files", unit="file")
+
+        for result in pbar:
+            pbar.set_postfix_str(result.filename)
+            bytes_out = 0
+            if result.content:
+                lap = time.perf_counter()
+                bytes_out = writer.write(result.content)
+                index.add(positions[0], result, writer.filepath, writer.last_offset, writer.tell() - writer.last_offset)
+                _lap(result.timings, 'write', lap)
+                job_stats["output_files"] = writer.part
+                job_stats["successful"] += 1
+                if chunk_tokens:
+                    job_stats["chunks"] += result.content.count('\n')  # One JSONL line per chunk
+                if result.over_limit:
+                    job_stats["degraded"] += 1
+            elif result.over_limit:
+                job_stats["skipped"] += 1
+            elif result.duplicate_of:
+                job_stats["duplicates"] += 1
+            else:
+                job_stats["failed"] += 1
+
+            if cache and result.cache_key:
+                if result.cached:
+                    cache.touch(result.cache_key)
+                    job_stats["cached"] += 1
+                elif result.content and not result.over_limit:
+                    # Degraded text is not cached, so raising the limits later converts the page in full.
+                    cache.put(result.cache_key, result.page_title, result.output_text, result.score, result.signature)
+
+            positions.popleft()
+            metrics.add(result, bytes_out)
+            files_done += 1
+            last_file = result.filename
+            if resumable and files_done % CHECKPOINT_INTERVAL == 0:
+                write_checkpoint()
+        completed = True
+
+    except KeyboardInterrupt:
+        logging.warning("Process interrupted by user. Shutting down gracefully.")
+    finally:
+        results.close()
+        stop_engine_pool()
+        if writer:
+            if completed:
+                if os.path.exists(checkpoint_path):
+                    os.remove(checkpoint_path)
+            elif resumable:
+                write_checkpoint()
+                logging.info(f"Checkpoint saved to {checkpoint_path}; rerun with --resume to continue.")
+            writer.close()
+        if index:
+            index.close()
+        total_files = total_files if total_files is not None else files_done
+        if shard and completed:
+            manifest_path = os.path.join(output_dir, f"{job_name}_manifest.json")
+            save_checkpoint(manifest_path, {
+                "version": VERSION,
+                "complete": True,
+                "input_folder": input_folder_name,
+                "shard": {"index": shard[0], "count": shard[1]},
+                "settings": settings,
+                "total_files": total_files,
+                "job_stats": job_stats,
+                "cache_used": cache is not None,
+                "index": os.path.basename(index.path),
+                "metrics": os.path.basename(metrics_path),
+            })
+            logging.info(f"Shard manifest saved to {manifest_path}; combine shards with 'merge'.")
+        if cache:
+            evicted = cache.evict()
+            if evicted:
+                logging.info(f"Evicted {evicted} entries from conversion cache {cache_path}.")
+            cache.close()
+        metrics.write(metrics_path, {
+            "settings": dict(settings, workers=workers),
+            "resumed_after": files_done - len(metrics.file_seconds),
+        })
+        summary = format_job_summary(engine, total_files, job_stats, 'jsonl' if chunk_tokens else output_format,
+                                     cache is not None,
+                                     log_path, metrics_path, peak_rss_bytes(), peak_child_rss_bytes())
+        print(summary)
+        logging.info("Job finished.")
+        logging.info(summary)
+        if job_stats["failed"] > 0:
+            sys.exit(1)
+
+# --- Conversion service ---
+
+class ServiceMetrics:
+    """Request counters and the latencies of recent requests, reported by the service's /metrics endpoint."""
+
+    def __init__(self, window: int = 1000) -> None:
+        self.started = time.perf_counter()
+        self.counts: Dict[str, int] = {"requests": 0, "converted": 0, "failed": 0, "rejected": 0, "timed_out": 0}
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        # Bounded, so a long-running service keeps constant memory; percentiles cover the last window requests.
+        self._request_seconds: Deque[float] = collections.deque(maxlen=window)
+        self._stage_seconds: Dict[str, Deque[float]] = {
+            stage: collections.deque(maxlen=window) for stage in PIPELINE_STAGES}
+
+    def count(self, key: str, delta: int = 1) -> None:
+        with self._lock:
+            self.counts[key] += delta
+
+    def add_in_flight(self, delta: int) -> None:
+        with self._lock:
+            self.in_flight += delta
+
+    def add(self, result: ConversionResult, seconds: float) -> None:
+        with self._lock:
+            self.counts["converted" if result.content else "failed"] += 1
+            self._request_seconds.append(seconds)
+            for stage, stage_seconds in result.timings.items():
+                self._stage_seconds[stage].append(stage_seconds)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            request_seconds = list(self._request_seconds)
+            stage_seconds = {stage: list(values) for stage, values in self._stage_seconds.items() if values}
+            counts = dict(self.counts)
+            in_flight = self.in_flight
+        return {
+            "uptime_s": round(time.perf_counter() - self.started, 3),
+            "in_flight": in_flight,
+            **counts,
+            "peak_rss_bytes": peak_rss_bytes(),
+            "latency": JobMetrics._distribution(request_seconds) if request_seconds else None,
+            "stages": {stage: JobMetrics._distribution(values) for stage, values in stage_seconds.items()},
+        }
+
+class ConversionService:
+    """Convert single documents for the serve subcommand, with a concurrency limit and a per-request timeout."""
+
+    def __init__(self, options: ConversionOptions, max_concurrent: int, timeout: float) -> None:
+        self.options = options
+        self.timeout = timeout
+        self.metrics = ServiceMetrics()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent)
+
+    def convert(self, name: str, raw: bytes, output_format: str) -> Tuple[int, Dict]:
+        """Run the extraction pipeline on one page; return the HTTP status and JSON body to send."""
+        self.metrics.count("requests")
+        started = time.perf_counter()
+        # The timeout covers waiting for a free slot as well as the conversion itself.
+        if not self._slots.acquire(timeout=self.timeout):
+            self.metrics.count("rejected")
+            return 503, {"error": "Too many concurrent conversions; retry later."}
+        options = self.options if output_format == self.options.output_format else replace(
+            self.options, output_format=output_format)
+        self.metrics.add_in_flight(1)
+        future = self._executor.submit(convert_document, raw, name, options)
+        # A timed-out conversion keeps its slot until it really finishes, so the limit stays honest.
+        future.add_done_callback(lambda _: (self.metrics.add_in_flight(-1), self._slots.release()))
+        try:
+            result = future.result(timeout=max(self.timeout - (time.perf_counter() - started), 0))
+        except concurrent.futures.TimeoutError:
+            self.metrics.count("timed_out")
+            return 504, {"error": f"Conversion did not finish within {self.timeout:g} seconds."}
+        self.metrics.add(result, time.perf_counter() - started)
+        if not result.content:
+            return 422, {"name": name, "error": result.error}
+        return 200, {
+            "name": name,
+            "title": result.page_title,
+            "score": result.score,
+            "format": output_format,
+            "text": result.output_text.strip(),
+            "document": result.content,  # The text as process_html_files would write it, with frontmatter for md
+            "sha256": result.content_hash,
+            "over_limit": result.over_limit,  # Set if the text came from the streaming fallback
+        }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+class _ServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP front end of ConversionService: POST /convert, GET /health and GET /metrics."""
+    server_version = f"html-converter/{VERSION}"
+    protocol_version = "HTTP/1.1"  # Keep-alive, so a client can stream many pages over one connection
+
+    def setup(self) -> None:
+        self.timeout = self.server.request_timeout  # Applies to reading the request from the socket
+        super().setup()
+
+    def do_GET(self) -> None:
+        path = urllib.parse.urlsplit(self.path).path
+        service: ConversionService = self.server.service
+        if path == '/health':
+            self._send_json(200, {
+                "status": "ok",
+                "version": VERSION,
+                "engine": service.options.engine,
+                "format": service.options.output_format,
+                "parser": service.options.parser,
+            })
+        elif path == '/metrics':
+            self._send_json(200, service.metrics.summary())
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint '{path}'."})
+
+    def do_POST(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/convert':
+            self._send_json(404, {"error": f"Unknown endpoint '{url.path}'."})
+            return
+        query = urllib.parse.parse_qs(url.query)
+        service: ConversionService = self.server.service
+        output_format = query.get('format', [service.options.output_format])[0]
+        name = query.get('name', ['request.html'])[0]
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            self.close_connection = True
+            self._send_json(411, {"error": "POST /convert needs a Content-Length header."})
+            return
+        if int(length) > self.server.max_request_bytes:
+            self.close_connection = True  # The body is not read, so the connection cannot be reused
+            self._send_json(413, {"error": f"Request body is larger than {self.server.max_request_bytes} bytes."})
+            return
+        raw = self.rfile.read(int(length))
+        if output_format not in ('md', 'txt'):
+            self._send_json(400, {"error": f"Invalid format '{output_format}'; expected md or txt."})
+            return
+        self._send_json(*service.convert(name, raw, output_format))
+
+    def _send_json(self, status: int, body: Dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix-socket'
+
+    def log_message(self, format: str, *args) -> None:
+        logging.info(f"{self.address_string()} - {format % args}")
+
+if hasattr(socketserver, 'UnixStreamServer'):  # Not on Windows
+    class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+def _raise_keyboard_interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+def serve(options: ConversionOptions, host: str = '127.0.0.1', port: int = 8765, unix_socket: Optional[str] = None,
+          max_concurrent: int = 4, timeout: float = 30.0, max_request_bytes: int = 10 * 1024 * 1024) -> None:
+    """Serve conversions over HTTP on host:port, or on a Unix socket, until interrupted."""
+    service = ConversionService(options, max_concurrent, timeout)
+    if options.persistent_engine:
+        start_engine_pool(size=max_concurrent, max_docs=options.engine_max_docs)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)  # Left behind by a service that did not shut down cleanly
+        server = _ThreadingUnixHTTPServer(unix_socket, _ServiceRequestHandler)
+        address = f"unix:{unix_socket}"
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), _ServiceRequestHandler)
+        address = f"http://{host}:{server.server_address[1]}"
+    server.service = service
+    server.request_timeout = timeout
+    server.max_request_bytes = max_request_bytes
+
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    logging.info(f"Serving conversions on {address}. Engine: {options.engine}. Parser: {options.parser}. "
+                 f"Max concurrent: {max_concurrent}")
+    print(f"Serving {options.engine} conversions on {address} (POST /convert, GET /health, GET /metrics). "
+          f"Press Ctrl+C to stop.", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Service interrupted; shutting down.")
+    finally:
+        server.server_close()
+        service.close()
+        stop_engine_pool()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+def serve_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="main.py serve",
+        description="Run a long-lived conversion service. POST HTML to /convert?format=md|txt&name=NAME and get\n"
+                    "JSON back with title, score and text; GET /health and /metrics report its state.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on (default: 8765).")
+    parser.add_argument("--unix-socket", metavar="PATH", help="Listen on a Unix socket instead of TCP.")
+    parser.add_argument("--format", choices=['md', 'txt'], default='md',
+                        help="Output format when a request does not ask for one (default: md).")
+    parser.add_argument("--engine", choices=['html-to-text', 'pandoc', 'native'], default='html-to-text',
+                        help="The conversion engine to use (default: html-to-text).")
+    parser.add_argument("--parser", choices=PARSER_BACKENDS, default='html5lib',
+                        help="The HTML parser backend (default: html5lib).")
+    parser.add_argument("--persistent-engine", action="store_true",
+                        help="Keep one resident Node worker per concurrent conversion for html-to-text.")
+    parser.add_argument("--engine-max-docs", type=int, default=500, metavar="N",
+                        help="Restart each resident engine worker after N documents (default: 500).")
+    parser.add_argument("--prefilter", action="store_true",
+                        help="Strip comments and script/style/svg/noscript blocks from large pages before parsing.")
+    parser.add_argument("--prefilter-min-bytes", type=int, default=PREFILTER_MIN_BYTES, metavar="BYTES",
+                        help=f"Only prefilter pages of at least this size (default: {PREFILTER_MIN_BYTES}).")
+    parser.add_argument("--max-nodes", type=int, default=0, metavar="N",
+                        help="Treat pages with more than about N tags as oversized (default: 0, no limit).")
+    parser.add_argument("--oversize", choices=OVERSIZE_ACTIONS, default='degrade',
+                        help="Convert oversized pages with the streaming text extractor, or skip them\n"
+                             "and answer 422 (default: degrade).")
+    parser.add_argument("--max-concurrent", type=int, default=4, metavar="N",
+                        help="Conversions run at once; further requests wait for a slot (default: 4).")
+    parser.add_argument("--timeout", type=float, default=30.0, metavar="SECONDS",
+                        help="Per-request limit for waiting, reading and converting; slower\n"
+                             "requests get 503 or 504 (default: 30).")
+    parser.add_argument("--max-request-mb", type=float, default=10.0, metavar="MB",
+                        help="Reject request bodies larger than this with 413 (default: 10).")
+    parser.add_argument("--log-file", metavar="PATH", help="Also write the detailed log to this file.")
+    args = parser.parse_args(argv)
+
+    setup_console_logging()
+    if args.log_file:
+        file_handler = logging.FileHandler(args.log_file, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(threadName)s - %(message)s'))
+        logging.getLogger().addHandler(file_handler)
+        logging.getLogger().setLevel(logging.INFO)
+    check_dependencies(args.engine)
+    check_parser_dependency(args.parser)
+    if args.persistent_engine and args.engine == 'html-to-text' and shutil.which("node") is None:
+        logging.critical("FATAL ERROR: 'node' command not found; --persistent-engine requires Node.js.")
+        sys.exit(1)
+    if args.unix_socket and not hasattr(socketserver, 'UnixStreamServer'):
+        logging.critical("FATAL ERROR: Unix sockets are not available on this platform; use --host/--port.")
+        sys.exit(1)
+    options = ConversionOptions(output_format=args.format, engine=args.engine,
+                                persistent_engine=args.persistent_engine and args.engine == 'html-to-text',
+                                engine_max_docs=args.engine_max_docs, parser=args.parser,
+                                prefilter=args.prefilter, prefilter_min_bytes=args.prefilter_min_bytes,
+                                max_nodes=args.max_nodes, oversize_action=args.oversize)
+    serve(options, args.host, args.port, args.unix_socket, max(args.max_concurrent, 1), args.timeout,
+          int(args.max_request_mb * 1024 * 1024))
+
+def merge_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="main.py merge",
+        description="Combine the outputs of a job run with --shard into the files a single-node run would write."
+    )
+    parser.add_argument("output_dir", help="The directory where merged output files will be saved.")
+    parser.add_argument("manifests", nargs="+", metavar="MANIFEST",
+                        help="The <folder>_shard<i>of<N>_manifest.json file of every shard.")
+    args = parser.parse_args(argv)
+    setup_console_logging()
+    merge_shards(args.manifests, args.output_dir)
+
+def lookup_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="main.py lookup",
+        description="Print single documents from a job's output using its <folder>_index.jsonl."
+    )
+    parser.add_argument("index", help="The <folder>_index.jsonl file written next to the output files.")
+    parser.add_argument("names", nargs="+", metavar="NAME",
+                        help="Input file paths (relative to the input directory) or archive record names.")
+    parser.add_argument("--entry", action="store_true",
+                        help="Print each document's index entry as JSON instead of its text.")
+    args = parser.parse_args(argv)
+
+    index = OutputIndex(args.index)
+    missing = False
+    for name in args.names:
+        entry = index.find(name)
+        if entry is None:
+            print(f"Error: '{name}' is not in {args.index}.", file=sys.stderr)
+            missing = True
+        elif args.entry:
+            print(json.dumps(entry, ensure_ascii=False))
+        else:
+            sys.stdout.write(index.read(entry))
+    if missing:
+        sys.exit(1)
+
+def main():
+    if sys.argv[1:2] == ["merge"]:
+        merge_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["lookup"]:
+        lookup_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["serve"]:
+        serve_main(sys.argv[2:])
+        return
+    parser = argparse.ArgumentParser(
+        description="A robust utility to extract and convert HTML content to Markdown or plain text.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("input_dir", help="The directory containing source HTML files.")
+    parser.add_argument("output_dir", help="The directory where output files will be saved.")
+    parser.add_argument(
+        "--format", 
+        choices=['md', 'txt'], 
+        default='md', 
+        help="The output file format:\n"
+             "  md  - Markdown (default)\n"
+             "  txt - Plain text"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=['html-to-text', 'pandoc', 'native'],
+        default='html-to-text',
+        help="The conversion engine to use:\n"
+             "  html-to-text - Enterprise-grade HTML parser (default)\n"
+             "  pandoc       - Original Pandoc-based converter\n"
+             "  native       - Pure-Python renderer, no subprocesses or Node.js"
+    )
+    parser.add_argument(
+        "--parser",
+        choices=PARSER_BACKENDS,
+        default='html5lib',
+        help="The HTML parser backend for extraction, scoring and cleaning:\n"
+             "  html5lib - Pure-Python, browser-exact parsing (default)\n"
+             "  lxml     - C-backed libxml2 parser, several times faster;\n"
+             "             requires 'pip install lxml'. Use compare_parsers.py\n"
+             "             to measure how much output changes on your corpus."
+    )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="Strip comments and <script>, <style>, <svg> and <noscript> blocks from\n"
+             "the raw bytes before parsing, so the parser never tokenizes them.\n"
+             "Files with markup too unusual to filter safely are parsed unfiltered."
+    )
+    parser.add_argument(
+        "--prefilter-min-bytes",
+        type=int,
+        default=PREFILTER_MIN_BYTES,
+        metavar="BYTES",
+        help=f"Only prefilter files of at least BYTES (default: {PREFILTER_MIN_BYTES}); smaller\n"
+             "files gain little. Prefiltered files are memory-mapped instead of read."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of worker processes for parse/score/clean/convert.\n"
+             "  1 - Process files serially in this process (default)\n"
+             "  0 - Use one worker per CPU core\n"
+             "Output is written by a single writer in sorted file order,\n"
+             "so it is byte-identical to a serial run."
+    )
+    parser.add_argument(
+        "--engine-concurrency",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Keep up to N engine calls in flight from this process with an asyncio\n"
+             "pipeline, reading and parsing the next files while engines run.\n"
+             "Output order is unchanged. 1 disables it (default); needs --workers 1."
+    )
+    parser.add_argument(
+        "--persistent-engine",
+        action="store_true",
+        help="Keep resident Node workers (engine-worker.js) running for the\n"
+             "html-to-text engine instead of spawning one process per file. A worker\n"
+             f"that does not answer within {ENGINE_TIMEOUT:g} seconds is restarted and the file fails."
+    )
+    parser.add_argument(
+        "--engine-max-docs",
+        type=int,
+        default=500,
+        metavar="N",
+        help="Restart each resident engine worker after N documents (default: 500)."
+    )
+    parser.add_argument(
+        "--pandoc-batch-size",
+        type=int,
+        default=1,
+        metavar="K",
+        help="Convert up to K documents per pandoc process (default: 1, no batching).\n"
+             "A failing batch is bisected so errors stay isolated per document."
+    )
+    parser.add_argument(
+        "--pandoc-batch-bytes",
+        type=int,
+        default=1024 * 1024,
+        metavar="BYTES",
+        help="Close a pandoc batch early once its cleaned HTML reaches BYTES (default: 1 MiB)."
+    )
+    parser.add_argument(
+        "--learn-boilerplate",
+        action="store_true",
+        help="Fingerprint candidate blocks (tag structure plus text) across the run and\n"
+             "prune blocks already seen on --boilerplate-min-pages pages, such as cookie\n"
+             "banners and related-post rails, before scoring. With --workers each worker\n"
+             "learns from the files it converts."
+    )
+    parser.add_argument(
+        "--boilerplate-min-pages",
+        type=int,
+        default=BOILERPLATE_MIN_PAGES,
+        metavar="N",
+        help=f"Pages a block must appear on before it is pruned (default: {BOILERPLATE_MIN_PAGES})."
+    )
+    parser.add_argument(
+        "--boilerplate-cache-size",
+        type=int,
+        default=BOILERPLATE_CACHE_SIZE,
+        metavar="N",
+        help=f"Fingerprints remembered, least recently seen evicted first (default: {BOILERPLATE_CACHE_SIZE})."
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Skip pages whose extracted text nearly duplicates a page already converted,\n"
+             "such as pagination, print views and tracking-parameter variants. Pages are\n"
+             "compared by MinHash signatures of their word 5-shingles through an\n"
+             "in-memory LSH index before the engine runs, and skips are logged. Only\n"
+             "pages that converted successfully suppress others. With --workers the main\n"
+             "process decides in input order and converts a skipped page after all when\n"
+             "the page it resembled was not kept."
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=float,
+        default=DEDUP_THRESHOLD,
+        metavar="T",
+        help=f"Estimated Jaccard similarity from which a page is a near-duplicate (default: {DEDUP_THRESHOLD})."
+    )
+    parser.add_argument(
+        "--max-input-mb",
+        type=float,
+        default=0,
+        metavar="MB",
+        help="Treat pages larger than MB as oversized (default: 0, no limit)."
+    )
+    parser.add_argument(
+        "--max-nodes",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Treat pages with more than about N tags as oversized, counted from the\n"
+             "raw bytes before parsing (default: 0, no limit)."
+    )
+    parser.add_argument(
+        "--doc-timeout",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="Treat pages whose parsing, scoring and cleaning takes longer than SECONDS\n"
+             "as oversized (default: 0, no limit). Unix only. The engine is not covered;\n"
+             f"each engine call is stopped after {ENGINE_TIMEOUT:g} seconds and the page fails."
+    )
+    parser.add_argument(
+        "--oversize",
+        choices=OVERSIZE_ACTIONS,
+        default='degrade',
+        help="What to do with oversized pages (default: degrade):\n"
+             "  degrade - write their plain text from a streaming extractor that builds no tree\n"
+             "  skip    - leave them out and log why"
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Write <folder>_chunks_<n>.jsonl instead of .md/.txt parts: each document is\n"
+             "split at paragraph and heading boundaries into chunks of at most N tokens,\n"
+             "one JSON line per chunk with its source, title, chunk number and token count\n"
+             "(default: 0, off)."
+    )
+    parser.add_argument(
+        "--tokenizer",
+        choices=TOKENIZERS,
+        default='estimate',
+        help="How --chunk-tokens counts tokens (default: estimate):\n"
+             f"  estimate - one token per {CHARS_PER_TOKEN} characters, no dependencies\n"
+             f"  tiktoken - exact {TIKTOKEN_ENCODING} counts, requires 'pip install tiktoken'"
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="PATH",
+        help="SQLite conversion cache. Files whose bytes, engine, format, parser and\n"
+             "converter version are unchanged reuse the cached text and skip\n"
+             "parsing and conversion."
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=1024,
+        metavar="MB",
+        help="Evict least recently used cache entries beyond this size (default: 1024, 0 = unlimited)."
+    )
+    parser.add_argument(
+        "--recursive",
+        action="store_true",
+        help="Also convert files in subdirectories of input_dir. Files are\n"
+             "discovered lazily, so work starts immediately on huge trees."
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="GLOB",
+        help="Only convert files matching GLOB (repeatable; default: *.html and *.htm).\n"
+             "Globs with a '/' match the path relative to input_dir, others the file name."
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="GLOB",
+        help="Skip files and directories matching GLOB (repeatable)."
+    )
+    parser.add_argument(
+        "--archives",
+        action="store_true",
+        help="Also read HTML straight out of .gz, .zip, .tar.* and .warc(.gz) files\n"
+             "in input_dir, without extracting them. Zip/tar members are filtered\n"
+             "with --include/--exclude; WARC records by their HTML content type.\n"
+             "'source:' is the member name or the record's target URI. WARC records\n"
+             "that are not identity, gzip or deflate encoded, or fail to decode, are\n"
+             "counted as failed."
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        help="Process files in directory order instead of sorting each directory by name.\n"
+             "Avoids holding a full directory listing in memory, but output order\n"
+             "then depends on the file system."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted job from its checkpoint in the output directory\n"
+             "instead of starting the output files from scratch. Jobs with --dedup or\n"
+             "--learn-boilerplate write no checkpoint and cannot be resumed."
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="I/N",
+        help="Convert only shard I of N (0-based), chosen by a stable hash of each file's\n"
+             "path so every machine agrees on the split. Each shard writes its own output\n"
+             "parts and a manifest; combine them with:\n"
+             "  python main.py merge OUTPUT_DIR SHARD_DIR/*_manifest.json"
+    )
+    parser.add_argument(
+        "--metrics-slowest",
+        type=int,
+        default=10,
+        metavar="N",
+        help="List the N slowest files in metrics_<folder>.json (default: 10)."
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILERS,
+        help="Profile the run and save it to the output directory:\n"
+             "  cprofile     - profile_<folder>.prof, view with 'python -m pstats'\n"
+             "  pyinstrument - profile_<folder>.html, requires 'pip install pyinstrument'\n"
+             "Only the main process is profiled; use --workers 1 to profile conversion."
+    )
+    parser.add_argument(
+        "--version",
+        action="version",
         version=f"HTML to Markdown/Text Converter {VERSION}"
     )
     
     args = parser.parse_args()
     
-    # We set up logging inside process_html_files once we know the output dir.
-    # But we check dependencies first based on selected engine.
+    # We set up the log file inside process_html_files once we know the output dir.
+    # But we check dependencies first based on selected engine, reporting problems on the console.
+    setup_console_logging()
     check_dependencies(args.engine)
+    check_parser_dependency(args.parser)
+    if args.chunk_tokens:
+        check_tokenizer_dependency(args.tokenizer)
+    
+    if args.persistent_engine and args.engine == 'html-to-text' and shutil.which("node") is None:
+        logging.critical("FATAL ERROR: 'node' command not found; --persistent-engine requires Node.js.")
+        sys.exit(1)
+    if args.engine_concurrency > 1 and args.workers != 1:
+        logging.critical("FATAL ERROR: --engine-concurrency runs in this process; use it with --workers 1.")
+        sys.exit(1)
     
-    process_html_files(args.input_dir, args.output_dir, args.format, args.engine)
+    job_args = (args.input_dir, args.output_dir, args.format, args.engine, args.workers,
+                args.persistent_engine and args.engine == 'html-to-text', args.engine_max_docs,
+                args.pandoc_batch_size, args.pandoc_batch_bytes, args.parser,
+                args.cache, args.cache_max_mb * 1024 * 1024, args.resume, args.metrics_slowest,
+                args.recursive, args.include, args.exclude, not args.unordered, args.archives,
+                args.prefilter, args.prefilter_min_bytes, args.shard, args.engine_concurrency,
+                args.learn_boilerplate, args.boilerplate_min_pages, args.boilerplate_cache_size,
+                int(args.max_input_mb * 1024 * 1024), args.max_nodes, args.doc_timeout, args.oversize,
+                args.chunk_tokens, args.tokenizer, args.dedup, args.dedup_threshold)
+    if args.profile:
+        os.makedirs(args.output_dir, exist_ok=True)
+        input_folder_name = os.path.basename(os.path.normpath(args.input_dir))
+        extension = 'html' if args.profile == 'pyinstrument' else 'prof'
+        profile_path = os.path.join(args.output_dir, f"profile_{input_folder_name}.{extension}")
+        run_profiled(args.profile, profile_path, process_html_files, *job_args)
+    else:
+        process_html_files(*job_args)
 
 if __name__ == "__main__":
     main()
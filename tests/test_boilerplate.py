@@ -0,0 +1,30 @@
+"""--learn-boilerplate state belongs to one job: later jobs in the same interpreter start from scratch."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+BANNER = '<div class="promo-box"><p>Subscribe to our newsletter for weekly updates and offers</p></div>'
+
+def _page(i: int) -> bytes:
+    words = ' '.join(f"page{i}word{j}" for j in range(80))
+    return f"<html><body><article>{BANNER}<p>{words}</p></article></body></html>".encode()
+
+def _texts(pages, min_pages: int = 3):
+    options = main.ConversionOptions(engine='native', learn_boilerplate=True, boilerplate_min_pages=min_pages)
+    return [result.text for result in main.iter_convert(pages, options)]
+
+def test_pruned_once_learned_within_a_job():
+    texts = _texts([_page(i) for i in range(5)])
+    assert ['Subscribe' in text for text in texts] == [True, True, True, False, False]
+
+def test_jobs_do_not_share_the_fingerprints():
+    _texts([_page(i) for i in range(5)])
+    assert 'Subscribe' in _texts([_page(9)])[0]
+
+def test_each_job_uses_its_own_min_pages():
+    _texts([_page(i) for i in range(5)], min_pages=1)
+    texts = _texts([_page(i) for i in range(5)], min_pages=4)
+    assert ['Subscribe' in text for text in texts] == [True, True, True, True, False]
@@ -0,0 +1,19 @@
+"""Conversion cache keys change with the converter revision, so output from older code is never served."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+PAGE = b"<html><body><article><p>Some text worth caching.</p></article></body></html>"
+
+def test_key_is_stable_within_a_revision():
+    options = main.ConversionOptions(engine='native')
+    assert main.conversion_cache_key(PAGE, options) == main.conversion_cache_key(PAGE, options)
+
+def test_key_changes_with_the_revision(monkeypatch):
+    options = main.ConversionOptions(engine='native')
+    before = main.conversion_cache_key(PAGE, options)
+    monkeypatch.setattr(main, 'CONVERTER_REVISION', main.CONVERTER_REVISION + 1)
+    assert main.conversion_cache_key(PAGE, options) != before
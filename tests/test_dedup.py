@@ -0,0 +1,29 @@
+"""--dedup state belongs to one job: later jobs in the same interpreter start from scratch."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+WORDS = [f"word{i}" for i in range(400)]
+
+def _page(changed: int) -> bytes:
+    """A page that differs from the others in its first `changed` words."""
+    words = [f"other{i}" if i < changed else word for i, word in enumerate(WORDS)]
+    return f"<html><body><article><p>{' '.join(words)}</p></article></body></html>".encode()
+
+def _duplicates(pages, threshold: float = main.DEDUP_THRESHOLD):
+    options = main.ConversionOptions(engine='native', dedup=True, dedup_threshold=threshold)
+    return [result.duplicate_of for result in main.iter_convert(pages, options)]
+
+def test_jobs_do_not_share_the_index():
+    pages = [_page(0), _page(4)]
+    assert _duplicates(pages) == [None, 'document-0.html']
+    assert _duplicates(pages) == [None, 'document-0.html']
+    assert _duplicates([_page(200)]) == [None]
+
+def test_each_job_uses_its_own_threshold():
+    pages = [_page(0), _page(8)]
+    assert _duplicates(pages, 0.8) == [None, 'document-0.html']
+    assert _duplicates(pages, 0.99) == [None, None]
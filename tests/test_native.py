@@ -0,0 +1,25 @@
+"""The native engine must not let paragraph text turn into Markdown block syntax."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+@pytest.mark.parametrize('text, expected', [
+    ('1. Preheat the oven', '1\\. Preheat the oven'),
+    ('2) Mix the flour', '2\\) Mix the flour'),
+    ('2024. A year in review', '2024\\. A year in review'),
+    ('# not a heading', '\\# not a heading'),
+    ('> not a quote', '\\> not a quote'),
+    ('- not a list', '\\- not a list'),
+    ('+ not a list', '\\+ not a list'),
+    ('1.5 million readers', '1.5 million readers'),
+])
+def test_paragraph_block_markers_are_escaped(text, expected):
+    assert main.convert_html_to_output_native(f"<p>{text}</p>", 'md') == expected + '\n'
+
+def test_plain_text_is_not_escaped():
+    assert main.convert_html_to_output_native("<p>1. Preheat the oven</p>", 'txt') == "1. Preheat the oven\n"
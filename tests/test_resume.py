@@ -0,0 +1,68 @@
+"""A job interrupted partway through must resume to the same output as an uninterrupted run."""
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+WORDS = ' '.join(f"word{i}" for i in range(60))
+
+def _make_input(directory, count: int = 30) -> None:
+    with zipfile.ZipFile(os.path.join(directory, 'pages.zip'), 'w') as archive:
+        for i in range(count):
+            archive.writestr(f"p{i:02}.html", f"<html><head><title>Page {i}</title></head><body>"
+                                              f"<article><p>Page {i}. {WORDS}</p></article></body></html>")
+
+def _interrupt_after(monkeypatch, count: int) -> None:
+    """Make the next job stop with KeyboardInterrupt after count results, like Ctrl+C."""
+    iter_convert = main.iter_convert
+
+    def interrupted(*args, **kwargs):
+        results = iter_convert(*args, **kwargs)
+        try:
+            for _ in range(count):
+                yield next(results)
+        finally:
+            results.close()
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(main, 'iter_convert', interrupted)
+
+def _read_output(directory) -> str:
+    with open(os.path.join(directory, 'input_output_1.md'), encoding='utf-8') as f:
+        return f.read()
+
+def test_resume_from_archive(tmp_path, monkeypatch):
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    _make_input(str(input_dir))
+
+    main.process_html_files(str(input_dir), str(tmp_path / 'full'), 'md', engine='native', archives=True)
+
+    resumed = str(tmp_path / 'resumed')
+    with monkeypatch.context() as patch:
+        _interrupt_after(patch, 15)
+        main.process_html_files(str(input_dir), resumed, 'md', engine='native', archives=True)
+    assert os.path.exists(os.path.join(resumed, 'input_checkpoint.json'))
+
+    # Interrupted again before the first new result: the checkpoint must still be written.
+    with monkeypatch.context() as patch:
+        _interrupt_after(patch, 0)
+        main.process_html_files(str(input_dir), resumed, 'md', engine='native', archives=True, resume=True)
+
+    main.process_html_files(str(input_dir), resumed, 'md', engine='native', archives=True, resume=True)
+    assert not os.path.exists(os.path.join(resumed, 'input_checkpoint.json'))
+    assert _read_output(resumed) == _read_output(str(tmp_path / 'full'))
+
+def test_dedup_jobs_are_not_resumable(tmp_path, monkeypatch):
+    input_dir = tmp_path / 'input'
+    input_dir.mkdir()
+    _make_input(str(input_dir))
+    output_dir = str(tmp_path / 'output')
+
+    with monkeypatch.context() as patch:
+        _interrupt_after(patch, 15)
+        main.process_html_files(str(input_dir), output_dir, 'md', engine='native', archives=True, dedup=True)
+    assert not os.path.exists(os.path.join(output_dir, 'input_checkpoint.json'))
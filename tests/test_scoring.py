@@ -0,0 +1,63 @@
+"""score_candidates must pick the same main content element as get_content_score."""
+import os
+import sys
+
+import pytest
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+PARSERS = ['html5lib', 'html.parser', 'lxml']
+
+WORDS = ' '.join(f"word{i}" for i in range(60))
+
+PAGES = {
+    'article': f"""<html><head><title>Article</title></head><body>
+        <header><a href="/">Home</a></header>
+        <div class="sidebar"><a href="/a">One</a> <a href="/b">Two</a> <a href="/c">Three</a></div>
+        <main><article class="post"><h1>Title</h1><p>{WORDS}</p><p>{WORDS}</p>
+            <div class="share"><a href="/s">Share</a></div></article></main>
+        <footer>Footer text</footer></body></html>""",
+    'nested divs': f"""<html><body><div id="wrapper"><div class="content"><div>
+        <section><p>{WORDS}</p></section><section><p>{WORDS}</p><p>{WORDS}</p></section>
+        </div></div><div class="comments"><p>Nice post</p><p>Thanks</p></div></div></body></html>""",
+    'link heavy': f"""<html><body><div class="menu">{' '.join(f'<a href="/{i}">Link {i}</a>' for i in range(40))}</div>
+        <div><p>{WORDS}</p></div></body></html>""",
+    'comments and cdata': f"""<html><body><div><!-- {WORDS} --><p>Short</p></div>
+        <section><![CDATA[{WORDS}]]><p>{WORDS}</p></section></body></html>""",
+    'unclosed tags': f"""<html><body><div class="main"><p>{WORDS}<p>{WORDS}<div><p>{WORDS}
+        <section><p>{WORDS}</section></body></html>""",
+    'mis-nested': f"""<html><body><div><b><div><p>{WORDS}</b> tail</div></p>
+        <article><p>{WORDS}<div>block in p</p></div></article>
+        <div><a href="/x">outer <div>{WORDS}<a href="/y">inner</a></div></a></div>
+        <table><div class="content"><p>{WORDS}</p></div><tr><td>cell</td></tr></table></body></html>""",
+    'stray end tags': f"""<html><body></div></section><main><p>{WORDS}</p></article><p>{WORDS}</p></main>
+        </div><div class="story"><p>{WORDS}</div></p></body></html>""",
+}
+
+def _parse(html: str, parser: str) -> BeautifulSoup:
+    if parser == 'lxml':
+        pytest.importorskip('lxml')
+    soup = BeautifulSoup(html, parser)
+    for tag in soup(main.STRIPPED_TAGS):
+        tag.decompose()
+    return soup
+
+@pytest.mark.parametrize('parser', PARSERS)
+@pytest.mark.parametrize('name', sorted(PAGES))
+def test_scores_match_get_content_score(name, parser):
+    soup = _parse(PAGES[name], parser)
+    candidates = soup.find_all(main.CANDIDATE_TAGS)
+    scored = main.score_candidates(soup)
+    assert [tag for tag, _ in scored] == candidates
+    assert [score for _, score in scored] == [main.get_content_score(tag) for tag in candidates]
+
+@pytest.mark.parametrize('parser', PARSERS)
+@pytest.mark.parametrize('name', sorted(PAGES))
+def test_picks_same_element_as_get_content_score(name, parser):
+    soup = _parse(PAGES[name], parser)
+    expected = max(soup.find_all(main.CANDIDATE_TAGS), key=main.get_content_score)
+    best, _ = max(main.score_candidates(soup), key=lambda candidate: candidate[1])
+    assert best is expected